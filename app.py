@@ -1,12 +1,41 @@
 import os
 from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, session, url_for
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from crewai import Agent, Task, Crew
+try:
+    from crewai import LLM
+except ImportError:
+    LLM = None
+try:
+    from langchain_openai import ChatOpenAI
+except ImportError:
+    ChatOpenAI = None
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
 from getpass import getpass
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
 import json
 import re
 import uuid
+import time
+import sqlite3
+import threading
+import select
+import socket
+import heapq
+import hashlib
+import hmac
+import random
+import math
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import requests
 from github import Github, GithubException
 
@@ -14,8 +43,89 @@ app = Flask(__name__, static_folder='frontend/prompt-generator/build', static_ur
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24).hex())  # Required for sessions
 CORS(app, supports_credentials=True)  # Enable CORS with credentials
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Behind reverse proxies or load balancers, take the client address from the
+# X-Forwarded-For/-Proto headers set by this many trusted proxies; per-client
+# rate limits would otherwise see every user as the proxy
+trusted_proxies = int(os.environ.get("TRUSTED_PROXIES", 0))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
+# Configure logging: records are queued by the request thread and written as
+# JSON lines by a background listener, so log I/O stays off the request path
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    # Attributes every LogRecord has; anything else was passed via extra= and is emitted as a field
+    standard_attrs = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in self.standard_attrs:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue records without formatting them and drop them when the queue is full.
+
+    The standard QueueHandler formats each message in the calling thread;
+    deferring that to the listener keeps string formatting off the request.
+    """
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DeferredQueueHandler.dropped += 1
+
+class SamplingFilter(logging.Filter):
+    """Keep only a sampled fraction of crew trace records, with a separate rate per level"""
+
+    def filter(self, record):
+        if not record.name.startswith("crew"):
+            return True
+        rate = logging_settings['sample_rates'].get(record.levelname, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+# Runtime-adjustable logging settings; changed through /api/admin/logging without a restart
+logging_settings = {
+    'level': os.environ.get("LOG_LEVEL", "INFO").upper(),
+    'crew_verbose': os.environ.get("CREW_VERBOSE", "false").lower() == "true",
+    'sample_rates': json.loads(os.environ.get("CREW_TRACE_SAMPLE_RATES", '{"DEBUG": 0.1}')),
+}
+
+def configure_logging():
+    """Route all logging through a bounded queue to a JSON listener thread"""
+    log_queue = queue.Queue(int(os.environ.get("LOG_QUEUE_SIZE", 10000)))
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(logging_settings['level'])
+    return listener
+
+log_listener = configure_logging()
+crew_trace_logger = logging.getLogger("crew.trace")
 
 # API Keys and configuration
 api_key = os.environ.get("OPENAI_API_KEY", "")
@@ -31,10 +141,1056 @@ github_oauth_redirect = os.environ.get(
     f"http://localhost:{port}/api/github/callback"
 )
 
-os.environ["OPENAI_MODEL"] = "gpt-4o-mini"
+default_model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+os.environ["OPENAI_MODEL"] = default_model
+
+# How many times a stage is retried after the provider answers with a 429
+provider_rate_limit_retries = int(os.environ.get("PROVIDER_RATE_LIMIT_RETRIES", 3))
+
+# How long (seconds) a repository's label list is cached before being fetched again
+label_cache_ttl = int(os.environ.get("LABEL_CACHE_TTL", 600))
+
+# Pipelined mode streams the plan and starts prompt runs per task block while it is written
+pipelined_generation = os.environ.get("PIPELINED_GENERATION", "false").lower() == "true"
+pipeline_max_concurrency = int(os.environ.get("PIPELINE_MAX_CONCURRENCY", 4))
+
+# Near-duplicate requirements: how similar (0-1, estimated Jaccard) an earlier request must be
+# for its plan to be reused, and whether a match warm-starts planning when not reused outright
+similar_plan_threshold = float(os.environ.get("SIMILAR_PLAN_THRESHOLD", 0.8))
+similar_plan_warm_start = os.environ.get("SIMILAR_PLAN_WARM_START", "true").lower() == "true"
+similar_plan_max_entries = int(os.environ.get("SIMILAR_PLAN_MAX_ENTRIES", 100000))
+
+# Overall time limit (seconds) for one generation request across all stages
+request_deadline = int(os.environ.get("REQUEST_DEADLINE", 600))
+
+# Per-stage model routing: which model serves each pipeline stage, how many
+# tokens it may generate, and how long (seconds) it may take before the stage
+# is abandoned and retried on the fallback model. Override any stage with the
+# STAGE_MODEL_ROUTES environment variable, e.g.
+# STAGE_MODEL_ROUTES='{"planning": {"model": "gpt-4o", "timeout": 240}}'
+fallback_model = os.environ.get("OPENAI_FALLBACK_MODEL", "gpt-4o-mini")
+stage_routes = {
+    'validate_key': {'model': default_model, 'max_tokens': 20, 'timeout': 20},
+    'planning': {'model': default_model, 'max_tokens': 4000, 'timeout': 180},
+    'prompts': {'model': default_model, 'max_tokens': 4000, 'timeout': 180},
+    'github_issues': {'model': default_model, 'max_tokens': 2000, 'timeout': 120},
+}
+for stage, overrides in json.loads(os.environ.get("STAGE_MODEL_ROUTES", "{}")).items():
+    stage_routes.setdefault(stage, {'model': default_model, 'max_tokens': 4000, 'timeout': 180}).update(overrides)
+for route in stage_routes.values():
+    route.setdefault('fallback_model', fallback_model)
+
+# How long an OAuth login may take before its state value is discarded
+oauth_state_ttl = int(os.environ.get("OAUTH_STATE_TTL", 600))
+
+# Namespaces of the state backend (the key prefix before ':') whose number of
+# expiring entries is capped, oldest first. Only entries that are cheap to lose
+# belong here; rate-limit buckets, metrics and settings are never evicted.
+state_capacities = {
+    'oauth_state': int(os.environ.get("OAUTH_STATE_MAX_ENTRIES", 100000)),
+    # Each worker's index removes the plans it evicts; this also bounds all workers together
+    'similar_plan': similar_plan_max_entries,
+}
+
+class MemoryStateBackend:
+    """
+    Keep shared state in a process-local dict.
+
+    Only suitable for a single worker process; use the SQLite or Redis
+    backend when serving with several workers or hosts. Expired entries are
+    removed by sweep(). Namespaces listed in capacities (the part of the key
+    before the first ':') are also capped, evicting that namespace's oldest
+    entries first, so a flood of one kind of entry (e.g. abandoned OAuth
+    logins) can't push out any other. Keys stored without a TTL are never
+    evicted.
+    """
+
+    name = "memory"
+
+    def __init__(self, capacities=None):
+        self.capacities = dict(capacities or {})
+        self.evictions = 0
+        self._data = {}
+        # Insertion order of the expiring keys in each capped namespace
+        self._order = {namespace: OrderedDict() for namespace in self.capacities}
+        # Min-heap of (expires_at, key) so expired entries can be found without a full scan
+        self._expiry = []
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        order = self._order.get(key.partition(":")[0])
+        if order is not None:
+            order.pop(key, None)
+        return entry
+
+    def _store(self, key, value, expires_at, now):
+        self._data[key] = (value, expires_at)
+        order = self._order.get(key.partition(":")[0])
+        if order is not None:
+            order.pop(key, None)
+            if expires_at is not None:
+                order[key] = None
+                while len(order) > self.capacities[key.partition(":")[0]]:
+                    oldest, _ = order.popitem(last=False)
+                    del self._data[oldest]
+                    self.evictions += 1
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+        
+        # Amortize the sweep over writes, so memory stays bounded even without a sweeper thread
+        self._expire(now, 4)
+        if len(self._expiry) > 2 * len(self._data):
+            # Evicted and overwritten keys leave stale heap items behind; rebuild from live data
+            self._expiry = [(e[1], k) for k, e in self._data.items() if e[1] is not None]
+            heapq.heapify(self._expiry)
+
+    def _expire(self, now, limit):
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now and removed < limit:
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self._data.get(key)
+            # Skip heap items left behind by keys that were overwritten since
+            if entry is not None and entry[1] == expires_at:
+                self._remove(key)
+            removed += 1
+        return removed
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live(key, time.time())
+            return entry[0] if entry else default
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._store(key, value, now + ttl if ttl else None, now)
+
+    def add(self, key, value, ttl=None):
+        """Set the key only if it does not exist yet. Returns True if it was set."""
+        now = time.time()
+        with self._lock:
+            if self._live(key, now):
+                return False
+            self._store(key, value, now + ttl if ttl else None, now)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._live(key, time.time())
+            if entry is None:
+                return default
+            self._remove(key)
+            return entry[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is None:
+                value = amount
+                self._store(key, value, now + ttl if ttl else None, now)
+            else:
+                value = entry[0] + amount
+                self._data[key] = (value, entry[1])
+            return value
+
+    def update(self, key, fn, ttl=None):
+        """
+        Atomically read-modify-write a key.
+
+        fn(value) receives the current value (None if missing) and returns a
+        (new_value, result) tuple; new_value is stored and result returned.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._live(key, now)
+            value, result = fn(entry[0] if entry else None)
+            self._store(key, value, now + ttl if ttl else None, now)
+            return result
+
+    def sweep(self, batch_size=1000):
+        """
+        Remove expired entries in small batches.
+
+        The lock is released between batches so request threads are never
+        blocked for long. Returns the number of heap items processed.
+        """
+        total = 0
+        while True:
+            with self._lock:
+                removed = self._expire(time.time(), batch_size)
+            total += removed
+            if removed < batch_size:
+                return total
+            # Yield the GIL to request threads between batches
+            time.sleep(0)
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'entries': len(self._data),
+            'capacities': self.capacities,
+            'evictions': self.evictions
+        }
+
+class SQLiteStateBackend:
+    """
+    Keep shared state in a SQLite file.
+
+    SQLite's file locking makes this safe for several worker processes on
+    the same host. Values are stored as JSON. sweep() removes expired rows,
+    then the oldest expiring rows of any namespace over its entry in
+    capacities; rows stored without a TTL are never evicted.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, capacities=None):
+        self.path = path
+        self.capacities = dict(capacities or {})
+        self.evictions = 0
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)")
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def _read(self, conn, key, now):
+        row = conn.execute(
+            "SELECT value, expires_at FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= now:
+            conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            return None
+        return row
+
+    def _write(self, conn, key, value, expires_at):
+        conn.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at)
+        )
+
+    def get(self, key, default=None):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._write(self._connect(), key, value, expires_at)
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._transaction()
+        try:
+            if self._read(conn, key, now):
+                conn.execute("COMMIT")
+                return False
+            self._write(conn, key, value, now + ttl if ttl else None)
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop(self, key, default=None):
+        conn = self._transaction()
+        try:
+            row = self._read(conn, key, time.time())
+            if row is not None:
+                conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return json.loads(row[0]) if row else default
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        conn = self._transaction()
+        try:
+            row = self._read(conn, key, now)
+            if row is None:
+                value, expires_at = amount, (now + ttl if ttl else None)
+            else:
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            self._write(conn, key, value, expires_at)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def update(self, key, fn, ttl=None):
+        now = time.time()
+        conn = self._transaction()
+        try:
+            row = self._read(conn, key, now)
+            value, result = fn(json.loads(row[0]) if row else None)
+            self._write(conn, key, value, now + ttl if ttl else None)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def sweep(self, batch_size=1000):
+        """Delete expired rows, then the oldest rows over capacity, in small batches."""
+        conn = self._connect()
+        total = 0
+        while True:
+            removed = conn.execute(
+                "DELETE FROM state WHERE rowid IN ("
+                "SELECT rowid FROM state WHERE expires_at <= ? LIMIT ?)",
+                (time.time(), batch_size)
+            ).rowcount
+            total += removed
+            if removed < batch_size:
+                break
+            time.sleep(0)
+        
+        # INSERT OR REPLACE assigns a fresh rowid, so the lowest rowids are the oldest entries.
+        # Keys of a namespace sort between 'namespace:' and 'namespace;' (';' follows ':').
+        for namespace, capacity in self.capacities.items():
+            bounds = (f"{namespace}:", f"{namespace};")
+            overflow = conn.execute(
+                "SELECT COUNT(*) FROM state WHERE key >= ? AND key < ? AND expires_at IS NOT NULL",
+                bounds
+            ).fetchone()[0] - capacity
+            while overflow > 0:
+                removed = conn.execute(
+                    "DELETE FROM state WHERE rowid IN ("
+                    "SELECT rowid FROM state WHERE key >= ? AND key < ? AND expires_at IS NOT NULL "
+                    "ORDER BY rowid LIMIT ?)",
+                    (*bounds, min(overflow, batch_size))
+                ).rowcount
+                self.evictions += removed
+                total += removed
+                overflow -= removed
+                time.sleep(0)
+        return total
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'entries': self._connect().execute("SELECT COUNT(*) FROM state").fetchone()[0],
+            'capacities': self.capacities,
+            'evictions': self.evictions
+        }
+
+class RedisStateBackend:
+    """
+    Keep shared state in Redis (or any server speaking the Redis protocol).
+
+    Any client object with the redis-py interface can be passed in, which
+    allows a local stand-in such as fakeredis to be used during testing.
+    """
+
+    name = "redis"
+
+    def __init__(self, client=None, url=None, prefix="promptgen:"):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("The redis package is required for STATE_BACKEND=redis. Install it with 'pip install redis'.")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + key
+
+    @staticmethod
+    def _ttl_ms(ttl):
+        return int(ttl * 1000) if ttl else None
+
+    def get(self, key, default=None):
+        raw = self.client.get(self._key(key))
+        return json.loads(raw) if raw is not None else default
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self._key(key), json.dumps(value), px=self._ttl_ms(ttl))
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(self._key(key), json.dumps(value), px=self._ttl_ms(ttl), nx=True))
+
+    def pop(self, key, default=None):
+        pipe = self.client.pipeline()
+        pipe.get(self._key(key))
+        pipe.delete(self._key(key))
+        raw, _ = pipe.execute()
+        return json.loads(raw) if raw is not None else default
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def incr(self, key, amount=1, ttl=None):
+        value = self.client.incrby(self._key(key), amount)
+        if ttl and value == amount:
+            # First increment created the key, so start its expiry window now
+            self.client.pexpire(self._key(key), self._ttl_ms(ttl))
+        return value
+
+    def update(self, key, fn, ttl=None):
+        from redis.exceptions import WatchError
+        
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self._key(key))
+                    raw = pipe.get(self._key(key))
+                    value, result = fn(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    pipe.set(self._key(key), json.dumps(value), px=self._ttl_ms(ttl))
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    # Another worker changed the key first; retry with the new value
+                    continue
+
+    def sweep(self, batch_size=1000):
+        # Redis expires keys itself; capacity is governed by the server's maxmemory policy
+        return 0
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'entries': self.client.dbsize()
+        }
+
+def create_state_backend(kind=None):
+    """
+    Build the state backend selected by the STATE_BACKEND environment variable.
+
+    Supported values are 'memory' (default), 'sqlite' and 'redis'.
+    """
+    kind = (kind or os.environ.get("STATE_BACKEND", "memory")).lower()
+    if kind == "memory":
+        return MemoryStateBackend(state_capacities)
+    if kind == "sqlite":
+        return SQLiteStateBackend(os.environ.get("STATE_SQLITE_PATH", "tmp/state.sqlite3"), state_capacities)
+    if kind == "redis":
+        return RedisStateBackend(url=os.environ.get("STATE_REDIS_URL"))
+    raise ValueError(f"Unknown STATE_BACKEND '{kind}'. Use 'memory', 'sqlite' or 'redis'.")
+
+def start_state_sweeper(interval=None):
+    """
+    Start the daemon thread that periodically removes expired state entries.
+
+    Only one sweeper runs per process: it sweeps whichever backend is
+    installed at the time, so calling create_app() again reuses it.
+    """
+    global state_sweeper
+    if state_sweeper and state_sweeper.is_alive():
+        return state_sweeper
+    interval = interval or int(os.environ.get("STATE_SWEEP_INTERVAL", 30))
+    
+    def sweep_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                removed = state_backend.sweep()
+                if removed:
+                    app.logger.debug(f"State sweep removed {removed} expired entries")
+            except Exception as e:
+                app.logger.error(f"Error sweeping state backend: {str(e)}")
+    
+    state_sweeper = threading.Thread(target=sweep_forever, name="state-sweeper", daemon=True)
+    state_sweeper.start()
+    return state_sweeper
+
+state_sweeper = None
+
+# Shared state: OAuth states, rate-limit counters, cancellation flags and caches.
+# Replaced by create_app() when serving with multiple worker processes.
+state_backend = MemoryStateBackend(state_capacities)
+
+class PipelineCancelled(Exception):
+    """Raised when a generation run is cancelled between stages or LLM calls."""
+
+    def __init__(self, stage, reason):
+        super().__init__(f"Cancelled during '{stage}': {reason}")
+        self.stage = stage
+        self.reason = reason
+
+def client_disconnected(environ):
+    """Check, without blocking, whether the client behind a WSGI request has closed its connection."""
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        # A readable socket with nothing to read has been closed by the peer
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+class CancellationToken:
+    """
+    Cooperative cancellation for a generation run.
+
+    A token is cancelled explicitly, when its deadline passes, when the
+    client disconnects, when a flag is set at cancel_key in the state
+    backend, or when its parent token is cancelled.
+    """
+
+    def __init__(self, deadline=None, environ=None, cancel_key=None, parent=None):
+        self.deadline = deadline
+        self.environ = environ
+        self.cancel_key = cancel_key
+        self.parent = parent
+        self.reason = None
+
+    def cancel(self, reason):
+        if self.reason is None:
+            self.reason = reason
+
+    def cancelled(self):
+        """Return the cancellation reason, or None while the run may continue."""
+        if self.reason is None:
+            if self.parent is not None and self.parent.cancelled():
+                self.reason = self.parent.reason
+            elif self.deadline is not None and time.time() >= self.deadline:
+                self.reason = "deadline exceeded"
+            elif self.environ is not None and client_disconnected(self.environ):
+                self.reason = "client disconnected"
+            elif self.cancel_key and state_backend.get(self.cancel_key):
+                self.reason = "cancelled by request"
+        return self.reason
+
+    def check(self, stage):
+        if self.cancelled():
+            raise PipelineCancelled(stage, self.reason)
+
+    def wait(self):
+        """Sleep until the deadline passes, returning early only if cancelled for another reason."""
+        while self.deadline is not None and time.time() < self.deadline and not self.cancelled():
+            time.sleep(min(0.5, max(0, self.deadline - time.time())))
+        if self.reason is not None and self.reason != "deadline exceeded":
+            raise PipelineCancelled("backoff", self.reason)
+
+    def step_callback(self, stage):
+        """
+        Build a CrewAI step callback that traces each step and stops the crew
+        between LLM calls once cancelled.
+        """
+        def callback(step_output):
+            if crew_trace_logger.isEnabledFor(logging.DEBUG):
+                # The step is passed as an argument so it is only rendered if the record is kept
+                crew_trace_logger.debug("%s", step_output, extra={'stage': stage})
+            self.check(stage)
+        return callback
+
+def cancel_key(api_key, request_id):
+    """State key of a run's cancel flag, scoped to the API key so clients can't cancel each other's runs"""
+    return "cancel:" + hashlib.sha256(f"{api_key}:{request_id}".encode("utf-8")).hexdigest()[:24]
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls so only one of them does the work.
+
+    Callers in the same process wait on the leader's result directly. Callers
+    in other worker processes find the in-flight marker in the state backend
+    and poll for the result the leader publishes there.
+    """
+
+    def __init__(self, poll_interval=0.5, result_ttl=30, flight_ttl=900):
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.flight_ttl = flight_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, cancel_token=None):
+        """
+        Run fn() unless an identical call is already in flight.
+
+        Returns a (result, shared) tuple, where shared is True when the result
+        came from another request's run. fn() must return a JSON-serializable value.
+        While waiting on another run, cancel_token is checked on every poll.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+                leader = True
+            else:
+                leader = False
+        
+        if not leader:
+            while not call['event'].wait(self.poll_interval):
+                if cancel_token is not None:
+                    cancel_token.check("waiting")
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+        
+        try:
+            result, shared = self._do_shared(key, fn, cancel_token)
+            call['result'] = result
+            return result, shared
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+    def _do_shared(self, key, fn, cancel_token):
+        while True:
+            if state_backend.add(f"inflight:{key}", True, ttl=self.flight_ttl):
+                try:
+                    result = fn()
+                    state_backend.set(f"flight_result:{key}", result, ttl=self.result_ttl)
+                    return result, False
+                finally:
+                    state_backend.delete(f"inflight:{key}")
+            
+            # Another worker is running it; wait for its result
+            while state_backend.get(f"inflight:{key}"):
+                if cancel_token is not None:
+                    cancel_token.check("waiting")
+                time.sleep(self.poll_interval)
+            result = state_backend.get(f"flight_result:{key}")
+            if result is not None:
+                return result, True
+            # The other run failed without publishing a result, so try to take over
+
+def generation_key(project_requirements, model):
+    """Key identical generation requests on normalized requirements plus model."""
+    normalized = " ".join(project_requirements.split()).casefold()
+    return hashlib.sha256(f"{model}\n{normalized}".encode("utf-8")).hexdigest()
+
+generation_flights = SingleFlight()
+
+class SimilarPlanIndex:
+    """
+    Find past requirements that are near-duplicates of new ones.
+
+    Requirements are reduced to word 3-gram shingles and a one-permutation
+    MinHash signature, computed locally: each shingle is hashed once into one
+    of num_perm bins, so a signature costs one hash per shingle rather than
+    num_perm of them. Signatures are split into LSH bands, so a lookup only
+    compares against entries sharing a band and costs the same however many
+    entries are stored. The band layout is derived from threshold, so pairs
+    at the threshold are almost always compared.
+
+    Signatures are kept in compact arrays in this process, capped at
+    max_entries with least-recently-used eviction; the plans themselves live
+    in the state backend. Each worker process therefore has its own index and
+    only finds requirements that it indexed itself.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, max_entries=100000, entry_ttl=7 * 24 * 3600):
+        self.num_perm = num_perm
+        self.bands, self.rows = self.banding(threshold, num_perm)
+        self.max_entries = max_entries
+        self.entry_ttl = entry_ttl
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def banding(threshold, num_perm, recall=0.99):
+        """
+        Pick (bands, rows) with bands * rows == num_perm for a similarity threshold.
+
+        Two entries with similarity s share at least one band with probability
+        1 - (1 - s**rows)**bands. More rows per band means fewer false candidates
+        to compare, so take the most rows that still give recall at threshold,
+        e.g. 16 bands of 4 rows at 0.8 and 32 bands of 2 rows at 0.6.
+        """
+        for rows in sorted((r for r in range(1, num_perm + 1) if num_perm % r == 0), reverse=True):
+            bands = num_perm // rows
+            if 1 - (1 - threshold ** rows) ** bands >= recall:
+                return bands, rows
+        return num_perm, 1
+
+    @staticmethod
+    def _shingles(text):
+        words = re.findall(r'[a-z0-9]+', text.casefold())
+        if len(words) < 3:
+            grams = words or [""]
+        else:
+            grams = [" ".join(words[i:i + 3]) for i in range(len(words) - 2)]
+        return {
+            int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+            for gram in grams
+        }
+
+    def signature(self, text):
+        # The low bits of each 64-bit shingle hash pick a bin, the high 32 bits compete for its minimum
+        empty = 0xFFFFFFFF
+        bins = [empty] * self.num_perm
+        for shingle in self._shingles(text):
+            index, value = shingle % self.num_perm, shingle >> 32
+            if value < bins[index]:
+                bins[index] = value
+        
+        # Fill empty bins from the next filled one to the right, offset by the distance
+        # travelled, so short texts still get comparable signatures (rotation densification)
+        signature = array('I', bins)
+        for index in range(self.num_perm):
+            if bins[index] != empty:
+                continue
+            distance = 1
+            while bins[(index + distance) % self.num_perm] == empty:
+                distance += 1
+            signature[index] = (bins[(index + distance) % self.num_perm] + distance * 0x9E3779B1) & 0xFFFFFFFF
+        return signature
+
+    def _band_keys(self, signature):
+        return [hash((band, tuple(signature[band * self.rows:(band + 1) * self.rows]))) for band in range(self.bands)]
+
+    def add(self, text, value):
+        """Store value (JSON-serializable) under text's signature"""
+        signature = self.signature(text)
+        entry_id = hashlib.sha256(signature.tobytes()).hexdigest()[:24]
+        state_backend.set(f"similar_plan:{entry_id}", value, ttl=self.entry_ttl)
+        
+        with self._lock:
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+                return
+            self._entries[entry_id] = signature
+            for key in self._band_keys(signature):
+                # Most buckets hold a single entry, so store it bare rather than in a list
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    self._buckets[key] = entry_id
+                elif isinstance(bucket, list):
+                    bucket.append(entry_id)
+                else:
+                    self._buckets[key] = [bucket, entry_id]
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id):
+        # The stored plan is useless without its signature, so drop it from the state backend too
+        state_backend.delete(f"similar_plan:{entry_id}")
+        # Band keys are recomputed rather than stored, to keep each entry small
+        for key in self._band_keys(self._entries.pop(entry_id)):
+            bucket = self._buckets.get(key)
+            if bucket == entry_id:
+                del self._buckets[key]
+            elif isinstance(bucket, list):
+                bucket.remove(entry_id)
+                if len(bucket) == 1:
+                    self._buckets[key] = bucket[0]
+
+    def lookup(self, text, threshold):
+        """
+        Return (similarity, value) for the most similar stored entry at or
+        above threshold, or None.
+        """
+        signature = self.signature(text)
+        best_id, best_similarity = None, threshold
+        
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                bucket = self._buckets.get(key)
+                if isinstance(bucket, list):
+                    candidates.update(bucket)
+                elif bucket is not None:
+                    candidates.add(bucket)
+            for entry_id in candidates:
+                stored = self._entries[entry_id]
+                similarity = sum(1 for x, y in zip(signature, stored) if x == y) / self.num_perm
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+        
+        value = state_backend.get(f"similar_plan:{best_id}")
+        if value is None:
+            # The stored plan expired or was evicted from the state backend
+            with self._lock:
+                if best_id in self._entries:
+                    self._remove(best_id)
+            return None
+        return best_similarity, value
+
+similar_plans = SimilarPlanIndex(similar_plan_threshold, max_entries=similar_plan_max_entries)
+
+class RateLimited(Exception):
+    """Raised when a request can't be admitted within the allowed wait."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit reached. Retry after {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Admit LLM work through token buckets kept in the state backend.
+
+    Every API key and the server as a whole get a bucket sized in requests
+    and tokens per minute. A request reserves capacity from both buckets.
+    If it would have to wait, it joins a bounded wait queue; if the wait is
+    too long or the queue is full, the reservation is returned and
+    RateLimited is raised so the client gets an immediate 429.
+
+    Buckets live under namespace in the state backend, which is never
+    capacity-evicted, so other traffic can't reset them. A limit of None
+    leaves that dimension unlimited.
+    """
+
+    def __init__(self, key_rpm, key_tpm, global_rpm, global_tpm, max_wait, max_queue, namespace="ratelimit"):
+        self.key_limits = {dim: limit for dim, limit in (('requests', key_rpm), ('tokens', key_tpm)) if limit is not None}
+        self.global_limits = {dim: limit for dim, limit in (('requests', global_rpm), ('tokens', global_tpm)) if limit is not None}
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.namespace = namespace
+
+    def _bucket_key(self, api_key):
+        # Never keep raw API keys in shared state
+        return f"{self.namespace}:key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:24]
+
+    @staticmethod
+    def _reserve(bucket_key, limits, cost):
+        """Take cost from a bucket, going negative if needed, and return the wait until it is covered."""
+        def take(bucket):
+            now = time.time()
+            if bucket is None:
+                bucket = dict(limits, updated=now, blocked_until=0)
+            elapsed = now - bucket['updated']
+            wait = max(0, bucket['blocked_until'] - now)
+            for dim, per_minute in limits.items():
+                rate = per_minute / 60.0
+                level = min(per_minute, min(per_minute, bucket[dim] + elapsed * rate) - cost[dim])
+                bucket[dim] = level
+                if level < 0:
+                    wait = max(wait, -level / rate)
+            bucket['updated'] = now
+            return bucket, wait
+        return state_backend.update(bucket_key, take, ttl=120)
+
+    def admit(self, api_key, tokens, cancel_token=None):
+        """Reserve one request and an estimated number of tokens, waiting in the queue if needed."""
+        cost = {'requests': 1, 'tokens': tokens}
+        buckets = [(self._bucket_key(api_key), self.key_limits), (f"{self.namespace}:global", self.global_limits)]
+        wait = max(self._reserve(key, limits, cost) for key, limits in buckets)
+        if wait <= 0:
+            return
+        
+        def join(queue):
+            queue = queue or 0
+            if queue >= self.max_queue:
+                return queue, False
+            return queue + 1, True
+        
+        def refund():
+            for key, limits in buckets:
+                self._reserve(key, limits, {'requests': -1, 'tokens': -tokens})
+        
+        if wait > self.max_wait or not state_backend.update(f"{self.namespace}:queue", join, ttl=self.max_wait + 60):
+            refund()
+            state_backend.incr("metrics:rate_limited_requests")
+            raise RateLimited(wait)
+        
+        try:
+            state_backend.incr("metrics:queued_requests")
+            deadline = time.time() + wait
+            while time.time() < deadline:
+                if cancel_token is not None:
+                    cancel_token.check("queued")
+                time.sleep(min(0.5, deadline - time.time()))
+        except PipelineCancelled:
+            # The run won't happen, so give its reservation back
+            refund()
+            raise
+        finally:
+            state_backend.update(f"{self.namespace}:queue", lambda queue: (max(0, (queue or 1) - 1), None), ttl=self.max_wait + 60)
+
+    def penalize(self, api_key, retry_after):
+        """Feed a provider 429 back into the key's bucket: drain it and hold admissions for retry_after."""
+        def block(bucket):
+            now = time.time()
+            bucket = bucket or {'updated': now}
+            bucket.update(requests=0, tokens=0, updated=now, blocked_until=now + retry_after)
+            return bucket, None
+        state_backend.update(self._bucket_key(api_key), block, ttl=max(120, retry_after + 60))
+        state_backend.incr("metrics:provider_rate_limits")
+
+def is_rate_limit_error(error):
+    """Recognize a provider 429, however the LLM client chose to wrap it."""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    message = str(error)
+    return "Rate limit" in message or "RateLimitError" in message or "429" in message
+
+def provider_retry_after(error, attempt):
+    """Use the provider's Retry-After header when present, else exponential backoff with jitter."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return min(60, 2 ** attempt) * (0.5 + random.random() / 2)
+
+def estimate_generation_tokens(project_requirements):
+    """Rough token budget for one plan + prompts run, used to size admission."""
+    prompt_overhead = 600
+    return (
+        len(project_requirements) // 4 + prompt_overhead
+        + 2 * stage_routes['planning']['max_tokens']  # the plan is generated, then read back by the prompt stage
+        + stage_routes['prompts']['max_tokens']
+    )
+
+admission = AdmissionController(
+    key_rpm=int(os.environ.get("RATE_LIMIT_KEY_RPM", 20)),
+    key_tpm=int(os.environ.get("RATE_LIMIT_KEY_TPM", 200000)),
+    global_rpm=int(os.environ.get("RATE_LIMIT_GLOBAL_RPM", 120)),
+    global_tpm=int(os.environ.get("RATE_LIMIT_GLOBAL_TPM", 2000000)),
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", 10)),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 20))
+)
+
+# GitHub logins are limited per client address and overall, with no queueing, so
+# unauthenticated traffic can't flood the OAuth state namespace
+login_admission = AdmissionController(
+    key_rpm=int(os.environ.get("LOGIN_RATE_LIMIT_RPM", 10)),
+    key_tpm=None,
+    global_rpm=int(os.environ.get("LOGIN_RATE_LIMIT_GLOBAL_RPM", 600)),
+    global_tpm=None,
+    max_wait=0,
+    max_queue=0,
+    namespace="ratelimit:login"
+)
+
+class StageTimeout(Exception):
+    """Raised when a pipeline stage misses its deadline on every model it was routed to."""
 
-# Store temporary state values for OAuth
-oauth_states = {}
+    def __init__(self, stage, timeout):
+        super().__init__(f"Stage '{stage}' did not finish within {timeout} seconds")
+        self.stage = stage
+        self.timeout = timeout
+
+def stage_llm(stage, model=None):
+    """Build the LLM for a pipeline stage, using its routed model unless one is given."""
+    route = stage_routes[stage]
+    model = model or route['model']
+    if LLM is not None:
+        return LLM(model=model, max_tokens=route['max_tokens'], timeout=route['timeout'])
+    if ChatOpenAI is not None:
+        # CrewAI before 0.60 has no LLM class but takes any LangChain chat model
+        return ChatOpenAI(model=model, max_tokens=route['max_tokens'], timeout=route['timeout'])
+    return model
+
+def run_stage(stage, run, cancel_token=None, api_key=None, make_llm=stage_llm):
+    """
+    Run one pipeline stage under its deadline.
+
+    run(llm, step_callback) builds and kicks off the stage's crew, passing
+    step_callback to the crew so it stops between LLM calls once cancelled.
+    llm is built by make_llm(stage, model), so a stage that calls the
+    provider itself can receive just the model name.
+    If the stage misses its deadline the attempt is cancelled and retried
+    once on the route's fallback model. A provider 429 is fed back into the
+    api_key's rate-limit bucket and retried with backoff. Returns a
+    (output, model) tuple naming the model that actually served the stage.
+    """
+    route = stage_routes[stage]
+    models = [route['model']]
+    if route['fallback_model'] and route['fallback_model'] != route['model']:
+        models.append(route['fallback_model'])
+    
+    for model in models:
+        for attempt in range(provider_rate_limit_retries + 1):
+            if cancel_token is not None:
+                cancel_token.check(stage)
+            attempt_token = CancellationToken(deadline=time.time() + route['timeout'], parent=cancel_token)
+            
+            # A separate thread per attempt, so an abandoned attempt never blocks the retry
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"stage-{stage}")
+            future = executor.submit(run, make_llm(stage, model), attempt_token.step_callback(stage))
+            executor.shutdown(wait=False)
+            try:
+                # Wait in short slices so a disconnect or cancel is noticed while the LLM call runs
+                while True:
+                    try:
+                        output = future.result(timeout=0.5)
+                        break
+                    except FutureTimeoutError:
+                        attempt_token.check(stage)
+            except PipelineCancelled:
+                # The attempt's token is cancelled now, so its crew stops at the next step
+                if cancel_token is not None and cancel_token.cancelled():
+                    raise
+                app.logger.warning(f"Stage '{stage}' timed out after {route['timeout']}s on {model}")
+                state_backend.incr(f"metrics:stage_timeouts:{stage}:{model}")
+                break
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == provider_rate_limit_retries:
+                    raise
+                delay = provider_retry_after(e, attempt + 1)
+                app.logger.warning(f"Stage '{stage}' hit the provider rate limit on {model}; retrying in {delay:.1f}s")
+                if api_key:
+                    admission.penalize(api_key, delay)
+                # Back off without ignoring cancellation
+                CancellationToken(deadline=time.time() + delay, parent=cancel_token).wait()
+                continue
+            
+            state_backend.incr(f"metrics:stage_model:{stage}:{model}")
+            return output, model
+    
+    raise StageTimeout(stage, route['timeout'])
+
+def stage_metrics():
+    """Collect per-stage counts of which model served each stage, and timeouts per model."""
+    result = {}
+    for stage, route in stage_routes.items():
+        served = {}
+        timeouts = {}
+        for model in {route['model'], route['fallback_model']}:
+            served[model] = state_backend.get(f"metrics:stage_model:{stage}:{model}", 0)
+            timeouts[model] = state_backend.get(f"metrics:stage_timeouts:{stage}:{model}", 0)
+        result[stage] = {'served_by': served, 'timeouts': timeouts}
+    return result
 
 # Helper function to extract content from CrewOutput objects
 def process_crew_output(crew_output):
@@ -58,34 +1214,50 @@ def process_crew_output(crew_output):
         app.logger.error(f"Error processing CrewOutput: {str(e)}")
         return str(crew_output)
 
-def create_project_plan(project_requirements):
+# Project Manager persona, shared by the planning crew and the streamed planner
+project_manager_profile = {
+    'role': "Project Manager",
+    'goal': (
+        "Oversee the app development by coordinating multiple AI agents, managing schedules, "
+        "allocating resources, and ensuring milestones are met on time and within scope."
+    ),
+    'backstory': (
+        "With over 10 years of experience in technology project management, I have successfully led "
+        "cross-functional teams in building innovative software solutions. My expertise includes agile "
+        "methodologies, risk management, and strategic planning, ensuring projects deliver optimum "
+        "quality while adhering to deadlines and budgets."
+    ),
+}
+
+def planning_task_description(project_requirements, reference_plan=None):
+    description = (
+        f"Analyze the following project requirements and create a detailed project plan:\n\n"
+        f"{project_requirements}\n\n"
+        "The plan should include: 1) Major milestones and timeline, 2) Resource allocation, "
+        "3) Tasks for different phases (design, implementation, testing, deployment), "
+        "4) Roles and responsibilities. Make the plan specific enough for other agents to use."
+    )
+    if reference_plan:
+        # Warm start from the plan for a near-identical earlier request
+        description += (
+            "\n\nA plan written for very similar requirements is below. Use it as a starting point "
+            "and adapt it wherever these requirements differ:\n\n"
+            f"{reference_plan}"
+        )
+    return description
+
+def create_project_plan(project_requirements, llm=None, step_callback=None, reference_plan=None):
     # Project Manager Agent
     project_manager = Agent(
-        role="Project Manager",
-        goal=(
-            "Oversee the app development by coordinating multiple AI agents, managing schedules, "
-            "allocating resources, and ensuring milestones are met on time and within scope."
-        ),
-        backstory=(
-            "With over 10 years of experience in technology project management, I have successfully led "
-            "cross-functional teams in building innovative software solutions. My expertise includes agile "
-            "methodologies, risk management, and strategic planning, ensuring projects deliver optimum "
-            "quality while adhering to deadlines and budgets."
-        ),
-        verbose=True,
-        llm="gpt-4o-mini",
+        **project_manager_profile,
+        verbose=logging_settings['crew_verbose'],
+        llm=llm or stage_llm("planning"),
     )
 
     # Project Planning Task
     planning_task = Task(
         agent=project_manager,
-        description=(
-            f"Analyze the following project requirements and create a detailed project plan:\n\n"
-            f"{project_requirements}\n\n"
-            "The plan should include: 1) Major milestones and timeline, 2) Resource allocation, "
-            "3) Tasks for different phases (design, implementation, testing, deployment), "
-            "4) Roles and responsibilities. Make the plan specific enough for other agents to use."
-        ),
+        description=planning_task_description(project_requirements, reference_plan),
         expected_output=(
             "A comprehensive project plan that includes milestones, resource allocation details, "
             "and specific tasks for each development phase."
@@ -96,14 +1268,15 @@ def create_project_plan(project_requirements):
     planning_crew = Crew(
         agents=[project_manager],
         tasks=[planning_task],
-        verbose=True
+        verbose=logging_settings['crew_verbose'],
+        step_callback=step_callback
     )
 
     # Run planning task
     project_plan = planning_crew.kickoff()
     return project_plan
 
-def create_ai_prompts(project_plan):
+def create_ai_prompts(project_plan, llm=None, step_callback=None):
     # Prompt Engineer Agent
     prompt_engineer = Agent(
         role="Prompt Engineer",
@@ -117,8 +1290,8 @@ def create_ai_prompts(project_plan):
             "precise, relevant, and creative outputs. I understand how to structure prompts with "
             "the right context, constraints, and instructions to get optimal results for different use cases."
         ),
-        verbose=True,
-        llm="gpt-4o-mini",
+        verbose=logging_settings['crew_verbose'],
+        llm=llm or stage_llm("prompts"),
     )
 
     # Prompt Engineering Task
@@ -141,21 +1314,332 @@ def create_ai_prompts(project_plan):
     prompt_crew = Crew(
         agents=[prompt_engineer],
         tasks=[prompt_engineering_task],
-        verbose=True
+        verbose=logging_settings['crew_verbose'],
+        step_callback=step_callback
     )
 
     # Run prompt engineering task
     ai_prompts = prompt_crew.kickoff()
     return ai_prompts
 
-def create_github_issues(project_plan, ai_prompts, repo_name):
+def stream_project_plan(project_requirements, model, step_callback=None, api_key=None, reference_plan=None):
+    """
+    Yield the project plan in chunks as the planning model writes it.
+
+    Uses the same persona and instructions as the planning crew, but calls
+    the OpenAI streaming API directly since crews only return whole outputs.
+    step_callback is called with each chunk, like a crew's step callback.
+    """
+    route = stage_routes['planning']
+    client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"), timeout=route['timeout'])
+    stream = client.chat.completions.create(
+        model=model,
+        max_tokens=route['max_tokens'],
+        stream=True,
+        messages=[
+            {
+                'role': 'system',
+                'content': (
+                    f"You are a {project_manager_profile['role']}. {project_manager_profile['backstory']}\n"
+                    f"Your goal: {project_manager_profile['goal']}"
+                )
+            },
+            {'role': 'user', 'content': planning_task_description(project_requirements, reference_plan)}
+        ]
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if step_callback is not None:
+            step_callback(delta)
+        if delta:
+            yield delta
+
+def generate_pipelined(project_requirements, cancel_token=None, api_key=None, reference_plan=None):
+    """
+    Overlap planning and prompt generation.
+
+    The plan is streamed and each task or milestone block starts its own
+    prompt run as soon as it is complete, up to pipeline_max_concurrency at
+    a time, so total latency approaches the plan time plus the slowest
+    prompt run rather than their sum.
+
+    The streamed plan runs under run_stage like any other stage. Each
+    planning attempt (the fallback after a timeout, or the retry after a
+    provider 429) cancels the prompt runs started by the attempts before it.
+    """
+    # Cancelled on any error, which stops every prompt run still in flight
+    pipeline_token = CancellationToken(parent=cancel_token)
+    executor = ThreadPoolExecutor(max_workers=pipeline_max_concurrency, thread_name_prefix="pipeline")
+    # (token, futures) of each planning attempt; futures are (block, future) pairs
+    attempts = []
+    
+    def submit(blocks, token, futures):
+        for block in blocks:
+            futures.append((block, executor.submit(
+                run_stage,
+                "prompts",
+                lambda llm, step_callback, block=block: create_ai_prompts(block, llm, step_callback),
+                token,
+                api_key
+            )))
+    
+    def cancel_attempts(reason):
+        for token, futures in attempts:
+            token.cancel(reason)
+            for _, future in futures:
+                future.cancel()
+    
+    def stream_plan(model, step_callback):
+        # run_stage only starts an attempt once the previous one was abandoned
+        cancel_attempts("planning attempt abandoned")
+        token, futures = CancellationToken(parent=pipeline_token), []
+        attempts.append((token, futures))
+        parser = IncrementalTaskParser()
+        for chunk in stream_project_plan(project_requirements, model, step_callback, api_key, reference_plan):
+            submit(parser.feed(chunk), token, futures)
+        submit(parser.finish(), token, futures)
+        return parser.text, futures
+    
+    try:
+        (project_plan, futures), planning_model = run_stage(
+            "planning", stream_plan, pipeline_token, api_key, make_llm=lambda stage, model: model
+        )
+        
+        if not futures:
+            # The plan had no task or milestone headers, so prompt for it as a whole
+            submit([project_plan], pipeline_token, futures)
+        
+        sections = []
+        prompt_models = []
+        for i, (block, future) in enumerate(futures, 1):
+            output, model = future.result()
+            title = parse_task_block(IncrementalTaskParser.strip_header(block))['title']
+            sections.append(f"## Task {i}: {title}\n\n{process_crew_output(output)}")
+            if model not in prompt_models:
+                prompt_models.append(model)
+    except BaseException:
+        # Stop prompt runs in flight at their next step and don't start the rest
+        pipeline_token.cancel("pipeline failed")
+        cancel_attempts("pipeline failed")
+        raise
+    finally:
+        executor.shutdown(wait=False)
+    
+    return {
+        'project_plan': project_plan,
+        'ai_prompts': "\n\n".join(sections),
+        'models': {'planning': planning_model, 'prompts': ", ".join(prompt_models)},
+        'llm_runs': 1 + len(futures)
+    }
+
+def generate_plan_and_prompts(project_requirements, cancel_token=None, api_key=None, pipelined=False, reuse_similar=False):
+    """
+    Run the planning and prompt crews, sharing the run with identical
+    requests that are already in flight. cancel_token is checked between
+    stages and between LLM calls. A new run must first be admitted against
+    api_key's rate limits, which raises RateLimited when over capacity.
+    With pipelined=True the prompt runs overlap the streamed plan.
+    
+    If earlier requirements were near-duplicates of these, their plan is
+    used to warm-start planning, or returned directly when reuse_similar is set.
+
+    Returns a dict with 'project_plan', 'ai_prompts', 'models' (the model
+    that served each stage), 'similar_plan' (the match used, if any) and
+    'shared', which is True when the result came from another request's run.
+    """
+    match = similar_plans.lookup(project_requirements, similar_plan_threshold)
+    similar_plan = None
+    reference_plan = None
+    if match:
+        similarity, stored = match
+        similar_plan = {'similarity': round(similarity, 3), 'reused': reuse_similar}
+        state_backend.incr("metrics:similar_plan_hits")
+        if reuse_similar:
+            state_backend.incr("metrics:llm_runs_saved", stored['llm_runs'])
+            return dict(stored, models={}, similar_plan=similar_plan, shared=False)
+        reference_plan = stored['project_plan'] if similar_plan_warm_start else None
+    
+    def run_crews():
+        if api_key:
+            admission.admit(api_key, estimate_generation_tokens(project_requirements), cancel_token)
+        state_backend.incr("metrics:generation_runs")
+        
+        if pipelined and OpenAI is not None:
+            result = generate_pipelined(project_requirements, cancel_token, api_key, reference_plan)
+            state_backend.incr("metrics:llm_runs", result['llm_runs'])
+            similar_plans.add(project_requirements, result)
+            return result
+        
+        # Generate the project plan and process the CrewOutput object to extract meaningful content
+        plan_output, plan_model = run_stage(
+            "planning",
+            lambda llm, step_callback: create_project_plan(project_requirements, llm, step_callback, reference_plan),
+            cancel_token,
+            api_key
+        )
+        project_plan = process_crew_output(plan_output)
+        
+        # Generate the AI prompts from the plan
+        prompts_output, prompts_model = run_stage(
+            "prompts",
+            lambda llm, step_callback: create_ai_prompts(project_plan, llm, step_callback),
+            cancel_token,
+            api_key
+        )
+        ai_prompts = process_crew_output(prompts_output)
+        
+        state_backend.incr("metrics:llm_runs", 2)
+        result = {
+            'project_plan': project_plan,
+            'ai_prompts': ai_prompts,
+            'models': {'planning': plan_model, 'prompts': prompts_model},
+            'llm_runs': 2
+        }
+        similar_plans.add(project_requirements, result)
+        return result
+    
+    key = generation_key(
+        project_requirements,
+        f"{stage_routes['planning']['model']}|{stage_routes['prompts']['model']}|{'pipelined' if pipelined else 'sequential'}"
+    )
+    while True:
+        try:
+            result, shared = generation_flights.do(key, run_crews, cancel_token)
+            break
+        except PipelineCancelled:
+            if cancel_token is not None and cancel_token.cancelled():
+                raise
+            # The run we joined was cancelled by its own client; run it for ours instead
+            app.logger.info(f"Shared generation run {key[:12]} was cancelled; retrying")
+    
+    if shared:
+        app.logger.info(f"Coalesced generation request {key[:12]} onto an in-flight run")
+        state_backend.incr("metrics:coalesced_requests")
+        state_backend.incr("metrics:llm_runs_saved", result['llm_runs'])
+    
+    return dict(result, similar_plan=similar_plan, shared=shared)
+
+def plan_id_for(project_requirements):
+    """Default scope of a plan's issue markers, derived from its normalized requirements"""
+    normalized = " ".join(project_requirements.split()).casefold()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+# Client-supplied plan ids end up in issue bodies, so keep them to a safe alphabet
+plan_id_pattern = re.compile(r'[A-Za-z0-9_.-]{1,64}')
+
+def task_id_for(task):
+    """Stable id for a task, derived from its normalized title, used to find its issue again on re-runs"""
+    normalized = " ".join(re.sub(r'[^a-z0-9]+', ' ', task.get('title', '').lower()).split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+def build_issue_body(task, prompt, plan_id, task_id):
+    """Render the issue body for a task, ending with the hidden plan-scoped task-id marker"""
+    return f"""
+## Task Description
+{task.get('description', '')}
+
+## Assignee
+{task.get('assignee', '')}
+
+## AI Prompt
+```
+{prompt}
+```
+
+<!-- ai-task-id: {plan_id}/{task_id} -->
+"""
+
+def normalize_label(assignee):
+    """
+    Clean an LLM-written assignee into a label name, so near-duplicates such as
+    '**QA Team**', 'QA team.' and '[QA Team (2)]' all become the same label.
+    """
+    label = re.sub(r'\([^)]*\)', ' ', assignee or '')   # drop parenthetical notes
+    label = re.sub(r'[*_`\[\]"]', ' ', label)            # drop markdown and brackets
+    label = " ".join(label.split()).strip(' .,:;-')
+    # GitHub limits label names to 50 characters
+    return label[:50].strip() or "Unassigned"
+
+def label_color(name):
+    """Deterministic color per label, so the same assignee looks the same in every repo"""
+    if name == "ai-generated":
+        return "5319e7"
+    return hashlib.md5(name.casefold().encode("utf-8")).hexdigest()[:6]
+
+def label_already_exists(error):
+    """Whether a GithubException from creating a label means the label exists already"""
+    data = error.data if isinstance(error.data, dict) else {}
+    return error.status == 422 and any(
+        isinstance(item, dict) and item.get('code') == 'already_exists' for item in data.get('errors') or []
+    )
+
+def provision_labels(repo, repo_name, wanted):
+    """
+    Make sure every label in wanted exists in the repository before issues use them.
+
+    The repository's labels are fetched once and cached per repository in the
+    state backend for label_cache_ttl seconds; only missing labels are created.
+    Returns a dict mapping each wanted name's casefolded form to the label
+    name to use, reusing an existing label that differs only in case. A
+    label GitHub refuses to create is logged and left out of the dict and cache.
+    """
+    cache_key = f"labels:{repo_name}"
+    existing = state_backend.get(cache_key)
+    if existing is None:
+        existing = [label.name for label in repo.get_labels()]
+    
+    names = {name.casefold(): name for name in existing}
+    created = []
+    for name in wanted:
+        if name.casefold() in names:
+            continue
+        try:
+            repo.create_label(name=name, color=label_color(name))
+            created.append(name)
+        except GithubException as e:
+            if not label_already_exists(e):
+                if e.status != 422:
+                    raise
+                # Any other 422 is a validation failure, e.g. a name GitHub won't accept
+                app.logger.warning(f"Could not create label '{name}' in {repo_name}: {str(e)}")
+                continue
+            # Someone else created it meanwhile, which is fine
+        names[name.casefold()] = name
+    
+    if created:
+        app.logger.info(f"Created {len(created)} labels in {repo_name}: {', '.join(created)}")
+    state_backend.set(cache_key, list(names.values()), ttl=label_cache_ttl)
+    return names
+
+issue_task_id_pattern = re.compile(r'<!-- ai-task-id: ([A-Za-z0-9_.-]+)/([0-9a-f]+) -->')
+
+def index_ai_issues(repo, plan_id):
+    """Fetch all ai-generated issues in one paginated listing and index plan_id's by their task-id marker"""
+    issues_by_task_id = {}
+    for issue in repo.get_issues(state='all', labels=['ai-generated']):
+        if issue.pull_request is not None:
+            continue
+        match = issue_task_id_pattern.search(issue.body or '')
+        # Issues of other plans in the same repository are left alone
+        if match and match.group(1) == plan_id and match.group(2) not in issues_by_task_id:
+            issues_by_task_id[match.group(2)] = issue
+    return issues_by_task_id
+
+def create_github_issues(project_plan, ai_prompts, repo_name, plan_id, sync=False):
     """
     Create GitHub issues for each task in the project plan, with prompts for each agent.
     
+    In sync mode, existing ai-generated issues of the same plan are matched
+    to tasks by the task-id marker in their body; only new tasks are created,
+    changed ones updated, and issues for tasks no longer in the plan closed.
+    Unchanged issues cost no write calls, so re-running an unchanged plan is safe.
+    
     Args:
         project_plan (str): The project plan with tasks
         ai_prompts (str): The AI prompts for each task
         repo_name (str): The GitHub repository name in format "username/repo"
+        plan_id (str): Scope of the task-id markers; sync only touches issues with the same plan_id
+        sync (bool): Sync with existing issues instead of always creating new ones
         
     Returns:
         dict: A dictionary with the result status and created issues
@@ -175,8 +1659,8 @@ def create_github_issues(project_plan, ai_prompts, repo_name):
         }
     
     try:
-        # Initialize GitHub client
-        g = Github(github_token)
+        # Initialize GitHub client, using the largest page size to keep listings to few calls
+        g = Github(github_token, per_page=100)
         
         try:
             # Try to get the repository
@@ -185,14 +1669,18 @@ def create_github_issues(project_plan, ai_prompts, repo_name):
             # Verify access by attempting to get repository issues
             try:
                 # This will fail if the user doesn't have issues access
-                # Just get one issue to verify access (without using limit parameter)
-                issues_iterator = repo.get_issues(state='all')
-                # Just try to access the first item if available
-                try:
-                    next(iter(issues_iterator))
-                except StopIteration:
-                    # No issues, but that's okay - we just needed to verify API access
-                    pass
+                if sync:
+                    # The listing we need for syncing verifies access too
+                    existing_issues = index_ai_issues(repo, plan_id)
+                else:
+                    # Just get one issue to verify access (without using limit parameter)
+                    issues_iterator = repo.get_issues(state='all')
+                    # Just try to access the first item if available
+                    try:
+                        next(iter(issues_iterator))
+                    except StopIteration:
+                        # No issues, but that's okay - we just needed to verify API access
+                        pass
             except GithubException as access_e:
                 if access_e.status == 403:
                     return {
@@ -235,41 +1723,74 @@ def create_github_issues(project_plan, ai_prompts, repo_name):
         # Match prompts to tasks
         prompts_by_task = match_prompts_to_tasks(ai_prompts, tasks)
         
+        # Provision every label the plan needs in one pass, instead of leaving it to each create_issue call
+        wanted_labels = {"ai-generated": "ai-generated"}
+        for task in tasks:
+            # The first spelling in the plan wins among names that differ only in case
+            name = normalize_label(task.get('assignee', ''))
+            wanted_labels.setdefault(name.casefold(), name)
+        try:
+            label_names = provision_labels(repo, repo_name, list(wanted_labels.values()))
+        except GithubException as le:
+            app.logger.warning(f"Could not provision labels in {repo_name}: {str(le)}")
+            label_names = {}
+        
         # Create issues
         created_issues = []
         failed_issues = []
+        updated_issues = []
+        unchanged_issues = []
+        closed_issues = []
+        seen_task_ids = set()
         
         for task in tasks:
             task_title = task.get('title', 'Unnamed Task')
-            task_description = task.get('description', '')
             task_assignee = task.get('assignee', '')
+            task_id = task_id_for(task)
+            
+            # The parser can find the same task more than once; it gets one issue
+            if task_id in seen_task_ids:
+                continue
+            seen_task_ids.add(task_id)
             
             # Get prompt for this task
             prompt = prompts_by_task.get(task_title, "No specific prompt available for this task.")
             
             # Create issue body with task description and prompt
-            issue_body = f"""
-## Task Description
-{task_description}
-
-## Assignee
-{task_assignee}
-
-## AI Prompt
-```
-{prompt}
-```
-            """
+            issue_body = build_issue_body(task, prompt, plan_id, task_id)
+            assignee_label = normalize_label(task_assignee)
+            labels = ["ai-generated", label_names.get(assignee_label.casefold(), assignee_label)]
             
             try:
-                # Create the issue
-                issue = repo.create_issue(
-                    title=task_title,
-                    body=issue_body,
-                    labels=["ai-generated", task_assignee]
-                )
+                issue = existing_issues.get(task_id) if sync else None
+                
+                if issue is None:
+                    # Create the issue
+                    issue = repo.create_issue(
+                        title=task_title,
+                        body=issue_body,
+                        labels=labels
+                    )
+                    results = created_issues
+                else:
+                    # Only send the fields that differ; skip the issue entirely if nothing does
+                    changes = {}
+                    if issue.title != task_title:
+                        changes['title'] = task_title
+                    if (issue.body or '').replace('\r\n', '\n').strip() != issue_body.strip():
+                        changes['body'] = issue_body
+                    if {label.name for label in issue.labels} != set(labels):
+                        changes['labels'] = labels
+                    if issue.state != 'open':
+                        changes['state'] = 'open'
+                    
+                    if changes:
+                        issue.edit(**changes)
+                        results = updated_issues
+                    else:
+                        results = unchanged_issues
                 
-                created_issues.append({
+                results.append({
                     "title": task_title,
                     "url": issue.html_url,
                     "assignee": task_assignee,
@@ -293,6 +1814,43 @@ def create_github_issues(project_plan, ai_prompts, repo_name):
                 
                 # Continue with other issues even if one fails
                 continue
+        
+        if sync:
+            # Close issues for tasks that are no longer in the plan
+            for task_id, issue in existing_issues.items():
+                if task_id in seen_task_ids or issue.state != 'open':
+                    continue
+                try:
+                    issue.edit(state='closed')
+                    closed_issues.append({
+                        "title": issue.title,
+                        "url": issue.html_url,
+                        "number": issue.number
+                    })
+                except GithubException as ie:
+                    app.logger.error(f"Error closing issue '{issue.title}': {str(ie)}")
+                    failed_issues.append({
+                        "title": issue.title,
+                        "error": str(ie)
+                    })
+            
+            result = {
+                "success": bool(created_issues or updated_issues or unchanged_issues or closed_issues) or not failed_issues,
+                "issues": created_issues + updated_issues + unchanged_issues,
+                "issues_created": created_issues,
+                "issues_updated": updated_issues,
+                "issues_closed": closed_issues,
+                "issues_unchanged": len(unchanged_issues),
+                "message": (
+                    f"Synced issues in {repo_name}: {len(created_issues)} created, {len(updated_issues)} updated, "
+                    f"{len(closed_issues)} closed, {len(unchanged_issues)} unchanged."
+                )
+            }
+            if failed_issues:
+                result["partial"] = True
+                result["issues_failed"] = failed_issues
+                result["message"] += f" {len(failed_issues)} issues failed."
+            return result
             
         if not created_issues:
             return {
@@ -337,6 +1895,72 @@ def create_github_issues(project_plan, ai_prompts, repo_name):
             "message": f"Error creating GitHub issues: {str(e)}"
         }
 
+def parse_task_block(block):
+    """Turn the text of one task block into a task dict with title, description and assignee"""
+    lines = block.strip().split('\n')
+    
+    # The first line is the task title
+    title = lines[0].strip()
+    
+    # The rest is the description
+    description = '\n'.join(lines[1:]).strip() if len(lines) > 1 else ""
+    
+    # Try to extract assignee if present
+    assignee = "Unassigned"
+    a_match = re.search(r'(?:Assigned to|Assignee|Responsible):\s*(.*?)(?=\n|$)', block, re.IGNORECASE)
+    if a_match:
+        assignee = a_match.group(1).strip()
+    
+    return {
+        "title": title,
+        "description": description,
+        "assignee": assignee
+    }
+
+class IncrementalTaskParser:
+    """
+    Detect complete task and milestone blocks in a plan while it is still being written.
+
+    A block is complete once the header of the next block has arrived, so
+    feed() returns only blocks that can no longer change; finish() returns
+    the last one when the stream ends.
+    """
+
+    header_pattern = re.compile(r'(?:Task|TASK|Milestone|Phase)\s+\d+:')
+
+    def __init__(self):
+        self.text = ""
+        self._block_start = None
+        self._scan_from = 0
+
+    def feed(self, chunk):
+        """Add streamed text and return the blocks it completed, each as (header, body) text"""
+        self.text += chunk
+        blocks = []
+        # Keep a few characters of overlap so a header split across chunks is still found
+        for match in self.header_pattern.finditer(self.text, max(0, self._scan_from - 16)):
+            if self._block_start is not None and match.start() <= self._block_start:
+                continue
+            if self._block_start is not None:
+                blocks.append(self.text[self._block_start:match.start()].strip())
+            self._block_start = match.start()
+        self._scan_from = len(self.text)
+        return blocks
+
+    @classmethod
+    def strip_header(cls, block):
+        """Drop a block's leading 'Task N:' style header, leaving its title and description"""
+        match = cls.header_pattern.match(block)
+        return block[match.end():].strip() if match else block
+
+    def finish(self):
+        """Return the final block once the stream has ended"""
+        if self._block_start is None:
+            return []
+        last = self.text[self._block_start:].strip()
+        self._block_start = None
+        return [last] if last else []
+
 def extract_tasks_from_plan(project_plan):
     """Extract tasks from the project plan text"""
     tasks = []
@@ -353,34 +1977,7 @@ def extract_tasks_from_plan(project_plan):
         matches = re.findall(pattern, project_plan, re.DOTALL)
         if matches:
             for match in matches:
-                lines = match.strip().split('\n')
-                if not lines:
-                    continue
-                    
-                # The first line is the task title
-                title = lines[0].strip()
-                
-                # The rest is the description
-                description = '\n'.join(lines[1:]).strip() if len(lines) > 1 else ""
-                
-                # Try to extract assignee if present
-                assignee = "Unassigned"
-                assignee_patterns = [
-                    r'(?:Assigned to|Assignee|Responsible):\s*(.*?)(?=\n|$)',
-                    r'(?:Assigned to|Assignee|Responsible):\s*(.*?)(?=\n|$)'
-                ]
-                
-                for a_pattern in assignee_patterns:
-                    a_match = re.search(a_pattern, match, re.IGNORECASE)
-                    if a_match:
-                        assignee = a_match.group(1).strip()
-                        break
-                
-                tasks.append({
-                    "title": title,
-                    "description": description,
-                    "assignee": assignee
-                })
+                tasks.append(parse_task_block(match))
     
     # If no tasks found, try to split by common section markers
     if not tasks:
@@ -417,7 +2014,7 @@ def match_prompts_to_tasks(ai_prompts, tasks):
     return prompts_by_task
 
 # GitHub Issues Agent
-def create_github_issues_agent(project_plan, ai_prompts):
+def create_github_issues_agent(project_plan, ai_prompts, llm=None, step_callback=None):
     # GitHub Issues Agent
     github_agent = Agent(
         role="GitHub Issues Manager",
@@ -430,8 +2027,8 @@ def create_github_issues_agent(project_plan, ai_prompts):
             "I excel at converting project plans into actionable tasks with clear instructions. "
             "I ensure that each issue contains all necessary information for successful completion."
         ),
-        verbose=True,
-        llm="gpt-4o-mini",
+        verbose=logging_settings['crew_verbose'],
+        llm=llm or stage_llm("github_issues"),
     )
     
     # GitHub Issues Task
@@ -455,7 +2052,8 @@ def create_github_issues_agent(project_plan, ai_prompts):
     github_crew = Crew(
         agents=[github_agent],
         tasks=[github_task],
-        verbose=True
+        verbose=logging_settings['crew_verbose'],
+        step_callback=step_callback
     )
     
     # Run GitHub Issues task
@@ -469,7 +2067,25 @@ def health_check():
         'message': 'API is running',
         'static_folder': app.static_folder,
         'static_folder_exists': os.path.exists(app.static_folder),
-        'index_html_exists': os.path.exists(os.path.join(app.static_folder, 'index.html'))
+        'index_html_exists': os.path.exists(os.path.join(app.static_folder, 'index.html')),
+        'state': state_backend.stats()
+    })
+
+@app.route('/api/metrics')
+def metrics():
+    """Report counters shared by all workers"""
+    return jsonify({
+        'generation_runs': state_backend.get("metrics:generation_runs", 0),
+        'llm_runs': state_backend.get("metrics:llm_runs", 0),
+        'coalesced_requests': state_backend.get("metrics:coalesced_requests", 0),
+        'llm_runs_saved': state_backend.get("metrics:llm_runs_saved", 0),
+        'cancelled_runs': state_backend.get("metrics:cancelled_runs", 0),
+        'queued_requests': state_backend.get("metrics:queued_requests", 0),
+        'rate_limited_requests': state_backend.get("metrics:rate_limited_requests", 0),
+        'provider_rate_limits': state_backend.get("metrics:provider_rate_limits", 0),
+        'similar_plan_hits': state_backend.get("metrics:similar_plan_hits", 0),
+        'stages': stage_metrics(),
+        'state': state_backend.stats()
     })
 
 @app.route('/', defaults={'path': ''})
@@ -490,6 +2106,10 @@ def generate_prompts():
     api_key = request.form.get('api_key', '')
     project_requirements = request.form.get('project_requirements', '')
     create_issues = request.form.get('create_issues', 'false').lower() == 'true'
+    pipelined = request.form.get('pipelined', str(pipelined_generation)).lower() == 'true'
+    sync_issues = request.form.get('sync_issues', 'false').lower() == 'true'
+    plan_id = request.form.get('plan_id', '')
+    reuse_similar = request.form.get('reuse_similar_plan', 'false').lower() == 'true'
     
     # Get GitHub token from session (if OAuth) or from request (if manual)
     github_token_input = session.get('github_token') or request.form.get('github_token', '')
@@ -501,6 +2121,11 @@ def generate_prompts():
             'error': 'OpenAI API key and project requirements are required'
         }), 400
     
+    if plan_id and not plan_id_pattern.fullmatch(plan_id):
+        return jsonify({
+            'error': 'plan_id may only contain letters, digits, ".", "_" and "-" (at most 64 characters)'
+        }), 400
+    
     # Set the API key in the environment
     os.environ["OPENAI_API_KEY"] = api_key
     
@@ -510,23 +2135,28 @@ def generate_prompts():
         global github_token
         github_token = github_token_input
     
+    # Stop spending tokens once the client goes away, the deadline passes, or the run is cancelled.
+    # Clients that want to cancel send their own request_id; either way it is echoed in X-Request-Id.
+    request_id = request.form.get('request_id') or str(uuid.uuid4())
+    cancel_token = CancellationToken(
+        deadline=time.time() + request_deadline,
+        environ=request.environ,
+        cancel_key=cancel_key(api_key, request_id)
+    )
+    
     try:
-        # Generate the project plan
-        project_plan_output = create_project_plan(project_requirements)
-        
-        # Process the CrewOutput object to extract meaningful content
-        project_plan = process_crew_output(project_plan_output)
-        
-        # Generate the AI prompts
-        ai_prompts_output = create_ai_prompts(project_plan)
-        
-        # Process the CrewOutput object to extract meaningful content
-        ai_prompts = process_crew_output(ai_prompts_output)
+        # Generate the project plan and AI prompts, joining an identical in-flight run if there is one
+        generation = generate_plan_and_prompts(project_requirements, cancel_token, api_key, pipelined, reuse_similar)
+        project_plan = generation['project_plan']
+        ai_prompts = generation['ai_prompts']
         
         # Create GitHub issues if requested
         github_issues_result = None
         if create_issues and github_token and github_repo_input:
-            github_issues_result = create_github_issues(project_plan, ai_prompts, github_repo_input)
+            cancel_token.check("github_issues")
+            github_issues_result = create_github_issues(
+                project_plan, ai_prompts, github_repo_input, plan_id or plan_id_for(project_requirements), sync_issues
+            )
         elif create_issues and (not github_token or not github_repo_input):
             github_issues_result = {
                 "success": False,
@@ -536,13 +2166,41 @@ def generate_prompts():
         # Return the results as strings (which are JSON serializable)
         response = {
             'project_plan': project_plan,
-            'ai_prompts': ai_prompts
+            'ai_prompts': ai_prompts,
+            'models': generation['models'],
+            'coalesced': generation['shared'],
+            'similar_plan': generation['similar_plan']
         }
         
         if github_issues_result:
             response['github_issues'] = github_issues_result
         
-        return jsonify(response)
+        response = jsonify(response)
+        response.headers['X-Request-Id'] = request_id
+        return response
+    except RateLimited as e:
+        app.logger.warning(f"Prompt generation rejected: {str(e)}")
+        response = jsonify({
+            'error': f"The server is busy. Please try again in {math.ceil(e.retry_after)} seconds."
+        })
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return response, 429
+    except PipelineCancelled as e:
+        app.logger.warning(f"Prompt generation cancelled during '{e.stage}': {e.reason}")
+        state_backend.incr("metrics:cancelled_runs")
+        if e.reason == "deadline exceeded":
+            return jsonify({
+                'error': "Prompt generation took too long and was stopped. Please try again later."
+            }), 504
+        # 499: the client closed the request or asked for it to be cancelled
+        return jsonify({
+            'error': "Prompt generation was cancelled."
+        }), 499
+    except StageTimeout as e:
+        app.logger.error(f"Prompt generation timed out: {str(e)}")
+        return jsonify({
+            'error': f"The {e.stage} step took too long to respond. Please try again later."
+        }), 504
     except Exception as e:
         error_message = str(e)
         if "APIError: OpenAIException - Connection error" in error_message:
@@ -564,6 +2222,26 @@ def generate_prompts():
         return jsonify({
             'error': error_message
         }), 500
+    finally:
+        # The request_id may be sent again later, so don't let this run's cancel flag outlive it
+        state_backend.delete(cancel_token.cancel_key)
+
+@app.route('/api/generate-prompts/cancel', methods=['POST'])
+def cancel_generation():
+    """Cancel a running generation by the API key and request_id the client sent with it"""
+    api_key = request.form.get('api_key', '')
+    request_id = request.form.get('request_id', '')
+    
+    if not api_key or not request_id:
+        return jsonify({
+            'success': False,
+            'message': 'api_key and request_id are required'
+        }), 400
+    
+    # Visible to whichever worker is running the request
+    state_backend.set(cancel_key(api_key, request_id), True, ttl=request_deadline)
+    app.logger.info(f"Cancellation requested for generation {request_id}")
+    return jsonify({'success': True})
 
 @app.route('/api/validate-key', methods=['POST'])
 def validate_api_key():
@@ -579,14 +2257,14 @@ def validate_api_key():
     # Set the API key in the environment
     os.environ["OPENAI_API_KEY"] = api_key
     
-    try:
+    def run_test(llm, step_callback):
         # Create a minimal agent to test the API key
         test_agent = Agent(
             role="Tester",
             goal="Test the API key validity",
             backstory="I am a test agent used to verify API key validity.",
-            verbose=True,
-            llm="gpt-4o-mini",
+            verbose=logging_settings['crew_verbose'],
+            llm=llm,
         )
         
         # Create a minimal task that should be quick to execute
@@ -600,18 +2278,38 @@ def validate_api_key():
         test_crew = Crew(
             agents=[test_agent],
             tasks=[test_task],
-            verbose=False
+            verbose=False,
+            step_callback=step_callback
         )
         
+        return test_crew.kickoff()
+    
+    try:
+        admission.admit(api_key, stage_routes['validate_key']['max_tokens'] + 100)
+        
         # Run a quick test - this will fail fast if the API key is invalid
         # Use our helper function to process the CrewOutput object
-        result = test_crew.kickoff()
+        result, model = run_stage("validate_key", run_test, api_key=api_key)
         processed_result = process_crew_output(result)
         
         return jsonify({
             'valid': True,
-            'message': 'API key is valid'
+            'message': 'API key is valid',
+            'model': model
+        })
+    except RateLimited as e:
+        response = jsonify({
+            'valid': False,
+            'message': f"The server is busy. Please try again in {math.ceil(e.retry_after)} seconds."
         })
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return response, 429
+    except StageTimeout as e:
+        app.logger.error(f"API key validation error: {str(e)}")
+        return jsonify({
+            'valid': False,
+            'message': 'OpenAI API did not respond in time. Please try again.'
+        }), 504
     except Exception as e:
         error_message = str(e)
         app.logger.error(f"API key validation error: {error_message}")
@@ -644,9 +2342,20 @@ def github_login():
             'details': 'The server administrator needs to configure GitHub OAuth credentials.'
         }), 400
     
+    try:
+        login_admission.admit(request.remote_addr or "unknown", 0)
+    except RateLimited as e:
+        app.logger.warning(f"GitHub login rejected: {str(e)}")
+        response = jsonify({
+            'success': False,
+            'message': f"Too many login attempts. Please try again in {math.ceil(e.retry_after)} seconds."
+        })
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return response, 429
+    
     # Generate a random state parameter to prevent CSRF attacks
     state = str(uuid.uuid4())
-    oauth_states[state] = True
+    state_backend.set(f"oauth_state:{state}", True, ttl=oauth_state_ttl)
     
     # Store state in session
     session['oauth_state'] = state
@@ -681,10 +2390,11 @@ def github_callback():
         app.logger.error(f"OAuth state mismatch. Expected: {session.get('oauth_state')}, Got: {state}")
         return redirect("/login-failed?error=invalid_state")
     
-    # Clean up state
-    if state in oauth_states:
-        del oauth_states[state]
+    # Clean up state; it must still be known to the shared store (not expired or already used)
     session.pop('oauth_state', None)
+    if not state_backend.pop(f"oauth_state:{state}"):
+        app.logger.error(f"OAuth state {state} is unknown or expired")
+        return redirect("/login-failed?error=invalid_state")
     
     # Exchange the code for an access token
     token_url = "https://github.com/login/oauth/access_token"
@@ -907,7 +2617,93 @@ def get_github_repos():
             'message': f"Error fetching repositories: {str(e)}"
         }), 500
 
+def refresh_logging_settings():
+    """Apply logging settings changed by any worker, reading the state backend at most every few seconds"""
+    global logging_settings_checked
+    if time.time() - logging_settings_checked < 5:
+        return
+    logging_settings_checked = time.time()
+    
+    shared = state_backend.get("logging:settings")
+    if shared and shared != logging_settings:
+        logging_settings.update(shared)
+        logging.getLogger().setLevel(logging_settings['level'])
+
+logging_settings_checked = 0
+
+@app.before_request
+def apply_logging_settings():
+    refresh_logging_settings()
+
+@app.route('/api/admin/logging', methods=['GET', 'POST'])
+def admin_logging():
+    """Show or change the log level, crew verbosity and trace sample rates for all workers"""
+    admin_token = os.environ.get("ADMIN_TOKEN", "")
+    supplied = request.headers.get('X-Admin-Token', '')
+    # Constant-time comparison, so the token can't be guessed from response timings
+    if not admin_token or not hmac.compare_digest(supplied.encode("utf-8"), admin_token.encode("utf-8")):
+        return jsonify({
+            'success': False,
+            'message': 'Admin token required'
+        }), 403
+    
+    if request.method == 'POST':
+        settings = request.get_json(silent=True) or {}
+        try:
+            if 'level' in settings:
+                level = str(settings['level']).upper()
+                if not isinstance(logging.getLevelName(level), int):
+                    raise ValueError(f"Unknown log level '{settings['level']}'")
+                logging_settings['level'] = level
+            if 'crew_verbose' in settings:
+                logging_settings['crew_verbose'] = bool(settings['crew_verbose'])
+            if 'sample_rates' in settings:
+                logging_settings['sample_rates'] = {
+                    level.upper(): float(rate) for level, rate in settings['sample_rates'].items()
+                }
+        except (ValueError, TypeError, AttributeError) as e:
+            return jsonify({
+                'success': False,
+                'message': f"Invalid logging settings: {str(e)}"
+            }), 400
+        
+        logging.getLogger().setLevel(logging_settings['level'])
+        # Share the change with the other workers
+        state_backend.set("logging:settings", logging_settings)
+        app.logger.info("Logging settings changed", extra={'settings': logging_settings})
+    
+    return jsonify({
+        'success': True,
+        'settings': logging_settings,
+        'dropped_records': DeferredQueueHandler.dropped
+    })
+
+def create_app(backend=None):
+    """
+    App factory for multi-process servers, e.g. gunicorn -w 4 'app:create_app()'.
+
+    Installs the shared state backend selected by STATE_BACKEND (or the one
+    passed in) so OAuth states, rate-limit counters, cancellation flags and
+    caches are visible to every worker.
+    """
+    global state_backend
+    state_backend = backend or create_state_backend()
+    
+    # Every worker must sign sessions with the same key, otherwise the OAuth
+    # callback fails whenever it lands on a different worker than the login.
+    # Stored without a TTL and outside state_capacities, so it is never evicted.
+    if not os.environ.get("FLASK_SECRET_KEY"):
+        state_backend.add("flask_secret_key", os.urandom(24).hex())
+        app.secret_key = state_backend.get("flask_secret_key")
+        if state_backend.name == "memory":
+            app.logger.warning("FLASK_SECRET_KEY is not set; sessions will not survive a restart or be shared between workers.")
+    
+    start_state_sweeper()
+    app.logger.info(f"Using '{state_backend.name}' state backend")
+    return app
+
 if __name__ == '__main__':
+    create_app()
     print(f"Static folder: {app.static_folder}")
     print(f"Static folder exists: {os.path.exists(app.static_folder)}")
     print(f"Index.html exists: {os.path.exists(os.path.join(app.static_folder, 'index.html'))}")
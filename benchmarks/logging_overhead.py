@@ -0,0 +1,127 @@
+"""
+Measure the logging cost a generation request pays on its own thread.
+
+Compares the original setup (logging.basicConfig writing to stderr, and
+crews running with verbose=True printing every step to stdout) with the
+queued JSON handler, where crew steps go to the sampled crew.trace logger.
+All cases write to a real file standing in for the container's log stream.
+
+The queued handler is measured three ways: like for like, with DEBUG on
+and every crew step traced; with 10% of the steps sampled; and with the
+default INFO level, where crew traces are off altogether.
+
+    python benchmarks/logging_overhead.py --requests 200 --steps 30
+"""
+import argparse
+import atexit
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import app
+
+logger = logging.getLogger("app")
+
+
+def simulate_request(steps, step_text, emit_step):
+    """Log what one plan + prompts run logs: a few app records and one trace per crew step"""
+    logger.info("Generating project plan and AI prompts", extra={'stage': 'planning'})
+    for i in range(steps):
+        emit_step(f"Step {i}: {step_text}")
+    logger.info("Generated project plan", extra={'stage': 'planning'})
+    logger.info("Generated AI prompts", extra={'stage': 'prompts'})
+
+
+def timed(requests, run):
+    # Warm up, so one-off costs such as the listener thread starting aren't counted
+    for _ in range(10):
+        run()
+    durations = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def basic_config(sink):
+    """The setup before the queued handler: synchronous stderr logging and verbose crews on stdout"""
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.getLogger().handlers = [handler]
+    logging.getLogger().setLevel(logging.INFO)
+    return lambda text: print(text, file=sink, flush=True)
+
+
+def queued_json(sink, level, sample_rate):
+    """The current setup: records queued for the listener thread, crew steps traced at DEBUG"""
+    app.logging_settings['level'] = level
+    app.logging_settings['sample_rates'] = {'DEBUG': sample_rate}
+    stderr, sys.stderr = sys.stderr, sink
+    try:
+        listener = app.configure_logging()
+    finally:
+        sys.stderr = stderr
+    callback = app.CancellationToken().step_callback("planning")
+    return listener, callback
+
+
+def stop(listener):
+    listener.stop()
+    # configure_logging() registered the listener to stop at exit, which would now fail
+    atexit.unregister(listener.stop)
+
+
+def report(name, durations, baseline=None):
+    durations = sorted(durations)
+    mean = statistics.mean(durations)
+    p95 = durations[int(len(durations) * 0.95) - 1]
+    line = f"{name:<24} mean {mean * 1e6:9.1f} us   p95 {p95 * 1e6:9.1f} us"
+    if baseline:
+        ratio = baseline / mean
+        line += f"   {ratio:.1f}x faster" if ratio >= 1 else f"   {1 / ratio:.1f}x slower"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=30, help="crew steps per request")
+    parser.add_argument("--step-size", type=int, default=2000, help="characters of text per crew step")
+    args = parser.parse_args()
+    step_text = "x" * args.step_size
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        stop(app.log_listener)
+    
+        with open(os.path.join(tmp, "before.log"), "w") as sink:
+            emit_step = basic_config(sink)
+            before = timed(args.requests, lambda: simulate_request(args.steps, step_text, emit_step))
+        
+        after = {}
+        for name, level, sample_rate in (
+            ("queued, every step", "DEBUG", 1.0),
+            ("queued, 10% of steps", "DEBUG", 0.1),
+            ("queued, INFO (no steps)", "INFO", 0.1),
+        ):
+            with open(os.path.join(tmp, f"{sample_rate}-{level}.log"), "w") as sink:
+                listener, emit_step = queued_json(sink, level, sample_rate)
+                after[name] = timed(args.requests, lambda: simulate_request(args.steps, step_text, emit_step))
+                stop(listener)
+    
+    print(f"{args.requests} requests, {args.steps} crew steps of {args.step_size} characters each")
+    report("basicConfig + verbose", before)
+    for name, durations in after.items():
+        report(name, durations, statistics.mean(before))
+    if app.DeferredQueueHandler.dropped:
+        print(f"records dropped by a full queue: {app.DeferredQueueHandler.dropped}")
+
+
+if __name__ == "__main__":
+    main()
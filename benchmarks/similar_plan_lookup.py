@@ -0,0 +1,82 @@
+"""
+Measure SimilarPlanIndex lookups against a large index.
+
+Fills an index with random requirements, then times lookups of unrelated
+requirements and of near-duplicates (a few words changed), and reports how
+many near-duplicates were found.
+
+    python benchmarks/similar_plan_lookup.py --entries 200000
+"""
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import app
+
+
+def report(name, durations):
+    durations = sorted(durations)
+    p95 = durations[int(len(durations) * 0.95) - 1]
+    print(f"{name:<24} median {statistics.median(durations) * 1e3:6.3f} ms   p95 {p95 * 1e3:6.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=150, help="words per requirements text")
+    parser.add_argument("--changes", type=int, default=3, help="words changed in each near-duplicate")
+    parser.add_argument("--threshold", type=float, default=app.similar_plan_threshold)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+    
+    rng = random.Random(1)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    
+    def requirements():
+        return [rng.choice(vocabulary) for _ in range(args.words)]
+    
+    app.state_backend = app.MemoryStateBackend(app.state_capacities)
+    index = app.SimilarPlanIndex(args.threshold, max_entries=args.entries)
+    print(f"{index.bands} bands of {index.rows} rows for threshold {args.threshold}")
+    
+    originals = []
+    start = time.perf_counter()
+    for i in range(args.entries):
+        words = requirements()
+        if i < args.lookups:
+            originals.append(words)
+        index.add(" ".join(words), {'plan': i})
+    elapsed = time.perf_counter() - start
+    print(f"added {args.entries} entries in {elapsed:.1f}s ({elapsed / args.entries * 1e3:.3f} ms each)")
+    
+    unrelated = []
+    for _ in range(args.lookups):
+        text = " ".join(requirements())
+        start = time.perf_counter()
+        index.lookup(text, args.threshold)
+        unrelated.append(time.perf_counter() - start)
+    
+    near, found = [], 0
+    for words in originals:
+        words = list(words)
+        for i in rng.sample(range(len(words)), args.changes):
+            words[i] = rng.choice(vocabulary)
+        start = time.perf_counter()
+        found += index.lookup(" ".join(words), args.threshold) is not None
+        near.append(time.perf_counter() - start)
+    
+    report("unrelated lookup", unrelated)
+    report("near-duplicate lookup", near)
+    print(f"near-duplicates found: {found}/{len(originals)}")
+    print(f"max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import {
   Box,
@@ -46,6 +46,8 @@ const PromptGenerator = () => {
   const [apiKey, setApiKey] = useState('');
   const [projectRequirements, setProjectRequirements] = useState('');
   const [loading, setLoading] = useState(false);
+  // Identifies the running generation so it can be cancelled
+  const requestIdRef = useRef(null);
   const [error, setError] = useState('');
   const [apiKeyStatus, setApiKeyStatus] = useState({ checked: false, valid: false, message: '' });
   const [results, setResults] = useState({
@@ -336,11 +338,17 @@ const PromptGenerator = () => {
       return;
     }
     
+    const requestId = window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    requestIdRef.current = requestId;
+    
     // Create form data
     const formData = new FormData();
     formData.append('api_key', apiKey);
     formData.append('project_requirements', projectRequirements);
     formData.append('create_issues', createGithubIssues.toString());
+    formData.append('request_id', requestId);
     
     // Only include token if manually entered (not using OAuth)
     if (createGithubIssues && !githubAuth.authenticated && githubToken) {
@@ -381,10 +389,28 @@ const PromptGenerator = () => {
         setError('An unexpected error occurred. Please try again later.');
       }
     } finally {
+      requestIdRef.current = null;
       setLoading(false);
     }
   };
 
+  // Stop the running generation; the pending request then fails with a cancelled error
+  const handleCancel = async () => {
+    if (!requestIdRef.current) {
+      return;
+    }
+    
+    const formData = new FormData();
+    formData.append('api_key', apiKey);
+    formData.append('request_id', requestIdRef.current);
+    
+    try {
+      await axios.post('/api/generate-prompts/cancel', formData);
+    } catch (err) {
+      console.error('Error cancelling generation:', err);
+    }
+  };
+
   // Render GitHub issues tab content
   const renderGitHubIssuesTab = () => {
     const { githubIssues } = results;
@@ -803,6 +829,18 @@ const PromptGenerator = () => {
           >
             {loading ? 'Generating...' : 'Generate Prompts'}
           </Button>
+          
+          {loading && (
+            <Button
+              variant="outlined"
+              color="secondary"
+              size="large"
+              onClick={handleCancel}
+              sx={{ mt: 2, ml: 2 }}
+            >
+              Cancel
+            </Button>
+          )}
         </form>
       </Paper>
 
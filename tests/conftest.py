@@ -0,0 +1,6 @@
+import os
+import sys
+
+# app.py lives in the repository root and reads its configuration on import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,54 @@
+import logging
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(app, "state_backend", app.MemoryStateBackend(app.state_capacities))
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("headers", [{}, {'X-Admin-Token': "wrong"}, {'X-Admin-Token': "s3cret-but-longer"}])
+def test_admin_logging_rejects_bad_tokens(client, headers):
+    assert client.get("/api/admin/logging", headers=headers).status_code == 403
+
+
+def test_admin_logging_accepts_token(client):
+    assert client.get("/api/admin/logging", headers={'X-Admin-Token': "s3cret"}).status_code == 200
+
+
+@pytest.fixture
+def restore_logging(monkeypatch):
+    monkeypatch.setattr(app, "logging_settings", dict(app.logging_settings))
+    root = logging.getLogger()
+    level = root.level
+    yield
+    root.setLevel(level)
+
+
+def test_admin_logging_change_is_picked_up_by_other_workers(client, restore_logging, monkeypatch):
+    response = client.post("/api/admin/logging", json={'level': "debug"}, headers={'X-Admin-Token': "s3cret"})
+    
+    assert response.status_code == 200
+    assert response.get_json()['settings']['level'] == "DEBUG"
+    assert logging.getLogger().level == logging.DEBUG
+    
+    # Another worker still has its own settings at INFO until it next checks the backend
+    monkeypatch.setattr(app, "logging_settings", dict(app.logging_settings, level="INFO"))
+    monkeypatch.setattr(app, "logging_settings_checked", 0)
+    logging.getLogger().setLevel(logging.INFO)
+    app.refresh_logging_settings()
+    
+    assert app.logging_settings['level'] == "DEBUG"
+    assert logging.getLogger().level == logging.DEBUG
+
+
+def test_admin_logging_rejects_unknown_level(client, restore_logging):
+    response = client.post("/api/admin/logging", json={'level': "chatty"}, headers={'X-Admin-Token': "s3cret"})
+    
+    assert response.status_code == 400
+    assert app.logging_settings['level'] != "CHATTY"
@@ -0,0 +1,38 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = app.MemoryStateBackend(app.state_capacities)
+    monkeypatch.setattr(app, "state_backend", backend)
+    return backend
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def test_cancel_is_scoped_to_api_key(backend, client):
+    client.post("/api/generate-prompts/cancel", data={'api_key': "sk-other", 'request_id': "1"})
+
+    assert app.CancellationToken(cancel_key=app.cancel_key("sk-other", "1")).cancelled() == "cancelled by request"
+    assert app.CancellationToken(cancel_key=app.cancel_key("sk-mine", "1")).cancelled() is None
+
+
+def test_cancel_requires_api_key(backend, client):
+    assert client.post("/api/generate-prompts/cancel", data={'request_id': "1"}).status_code == 400
+
+
+def test_cancel_flag_is_cleared_when_run_finishes(backend, client, monkeypatch):
+    def cancelled_run(project_requirements, cancel_token, *args):
+        client.post("/api/generate-prompts/cancel", data={'api_key': "sk-test", 'request_id': "1"})
+        cancel_token.check("planning")
+
+    monkeypatch.setattr(app, "generate_plan_and_prompts", cancelled_run)
+    form = {'api_key': "sk-test", 'project_requirements': "A todo app", 'request_id': "1"}
+
+    assert client.post("/api/generate-prompts", data=form).status_code == 499
+    assert backend.get(app.cancel_key("sk-test", "1")) is None
@@ -0,0 +1,30 @@
+import threading
+
+import app
+
+
+def test_generated_secret_key_survives_oauth_flood(tmp_path, monkeypatch):
+    monkeypatch.delenv("FLASK_SECRET_KEY", raising=False)
+    # create_app() replaces the module-level backend; put it back afterwards
+    monkeypatch.setattr(app, "state_backend", app.state_backend)
+    monkeypatch.setattr(app.app, "secret_key", app.app.secret_key)
+    backend = app.SQLiteStateBackend(str(tmp_path / "state.sqlite3"), {'oauth_state': 100})
+    flask_app = app.create_app(backend)
+    secret = flask_app.secret_key
+
+    for i in range(1000):
+        backend.set(f"oauth_state:{i}", True, ttl=600)
+    backend.sweep()
+
+    assert backend.get("flask_secret_key") == secret
+    # A second worker starting up afterwards signs sessions with the same key
+    assert app.create_app(app.SQLiteStateBackend(backend.path, {'oauth_state': 100})).secret_key == secret
+
+
+def test_create_app_starts_one_state_sweeper(monkeypatch):
+    monkeypatch.setattr(app, "state_backend", app.state_backend)
+    for _ in range(3):
+        app.create_app(app.MemoryStateBackend(app.state_capacities))
+
+    sweepers = [thread for thread in threading.enumerate() if thread.name == "state-sweeper"]
+    assert sweepers == [app.state_sweeper]
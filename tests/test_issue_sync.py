@@ -0,0 +1,87 @@
+import pytest
+
+import app
+
+plan = "Task 1: Set up the project\nAssigned to: Dev\n\nTask 2: Add login\nAssigned to: Dev\n"
+
+
+class FakeLabel:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeIssue:
+    def __init__(self, number, title, body, state='open'):
+        self.number = number
+        self.title = title
+        self.body = body
+        self.state = state
+        self.labels = [FakeLabel("ai-generated"), FakeLabel("Dev")]
+        self.html_url = f"https://github.com/owner/repo/issues/{number}"
+        self.pull_request = None
+        self.edits = []
+
+    def edit(self, **changes):
+        self.edits.append(changes)
+        for name, value in changes.items():
+            setattr(self, name, [FakeLabel(label) for label in value] if name == 'labels' else value)
+
+
+class FakeRepo:
+    def __init__(self, issues):
+        self.issues = issues
+
+    def get_issues(self, state='open', labels=None):
+        return list(self.issues)
+
+    def get_labels(self):
+        return [FakeLabel("ai-generated"), FakeLabel("Dev")]
+
+    def create_issue(self, title, body, labels):
+        issue = FakeIssue(len(self.issues) + 1, title, body)
+        self.issues.append(issue)
+        return issue
+
+
+def marked_issue(number, plan_id, title):
+    return FakeIssue(number, title, f"Body\n\n<!-- ai-task-id: {plan_id}/{app.task_id_for({'title': title})} -->")
+
+
+@pytest.fixture
+def repo(monkeypatch):
+    repo = FakeRepo([
+        marked_issue(1, "plan-a", "Set up the project"),
+        marked_issue(2, "plan-a", "Dropped from the plan"),
+        marked_issue(3, "plan-b", "Another plan's task"),
+    ])
+    monkeypatch.setattr(app, "state_backend", app.MemoryStateBackend(app.state_capacities))
+    monkeypatch.setattr(app, "github_token", "gh-token")
+    monkeypatch.setattr(app, "Github", lambda token, per_page=None: type("FakeGithub", (), {"get_repo": lambda self, name: repo})())
+    return repo
+
+
+def test_sync_only_touches_issues_of_the_same_plan(repo):
+    result = app.create_github_issues(plan, "", "owner/repo", "plan-a", sync=True)
+
+    assert [issue['number'] for issue in result['issues_created']] == [4]
+    assert [issue['number'] for issue in result['issues_closed']] == [2]
+    assert [issue['number'] for issue in result['issues_updated']] == [1]
+    assert repo.issues[2].edits == []
+    assert repo.issues[2].state == 'open'
+    assert "<!-- ai-task-id: plan-a/" in repo.issues[3].body
+
+
+def test_resync_of_unchanged_plan_makes_no_writes(repo):
+    app.create_github_issues(plan, "", "owner/repo", "plan-a", sync=True)
+    edits = [len(issue.edits) for issue in repo.issues]
+
+    result = app.create_github_issues(plan, "", "owner/repo", "plan-a", sync=True)
+
+    assert result['issues_unchanged'] == 2
+    assert len(repo.issues) == 4
+    assert [len(issue.edits) for issue in repo.issues] == edits
+
+
+def test_plan_id_defaults_to_normalized_requirements():
+    assert app.plan_id_for("A todo  app\n") == app.plan_id_for("a TODO app")
+    assert app.plan_id_for("A todo app") != app.plan_id_for("A chat app")
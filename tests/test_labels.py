@@ -0,0 +1,100 @@
+import pytest
+from github import GithubException
+
+import app
+
+
+class FakeLabel:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeRepo:
+    def __init__(self, names, refuse=None):
+        self.names = list(names)
+        self.refuse = refuse or {}
+        self.listings = 0
+        self.created = []
+
+    def get_labels(self):
+        self.listings += 1
+        return [FakeLabel(name) for name in self.names]
+
+    def create_label(self, name, color):
+        if name in self.refuse:
+            raise GithubException(*self.refuse[name], None)
+        self.created.append(name)
+        self.names.append(name)
+
+
+@pytest.fixture(autouse=True)
+def backend(monkeypatch):
+    backend = app.MemoryStateBackend(app.state_capacities)
+    monkeypatch.setattr(app, "state_backend", backend)
+    return backend
+
+
+@pytest.mark.parametrize("assignee", ["**QA Team**", "QA team.", "[QA Team (2)]", "  QA Team  "])
+def test_normalize_label_merges_variants(assignee):
+    assert app.normalize_label(assignee).casefold() == "qa team"
+
+
+def test_normalize_label_defaults_to_unassigned():
+    assert app.normalize_label("**  **") == "Unassigned"
+    assert app.normalize_label(None) == "Unassigned"
+
+
+def test_only_missing_labels_are_created():
+    repo = FakeRepo(["ai-generated", "Backend"])
+
+    names = app.provision_labels(repo, "owner/repo", ["ai-generated", "Backend", "QA Team"])
+
+    assert repo.created == ["QA Team"]
+    assert names["qa team"] == "QA Team"
+
+
+def test_case_only_duplicates_reuse_existing_label():
+    repo = FakeRepo(["qa team"])
+
+    names = app.provision_labels(repo, "owner/repo", ["QA Team"])
+
+    assert repo.created == []
+    assert names["qa team"] == "qa team"
+
+
+def test_labels_are_listed_once_per_cache_ttl(backend):
+    repo = FakeRepo(["ai-generated"])
+
+    app.provision_labels(repo, "owner/repo", ["ai-generated", "Backend"])
+    app.provision_labels(repo, "owner/repo", ["ai-generated", "Backend", "Frontend"])
+
+    assert repo.listings == 1
+    assert repo.created == ["Backend", "Frontend"]
+    assert sorted(backend.get("labels:owner/repo")) == ["Backend", "Frontend", "ai-generated"]
+
+
+def test_label_created_concurrently_counts_as_present(backend):
+    exists = {'message': "Validation Failed", 'errors': [{'resource': "Label", 'code': "already_exists", 'field': "name"}]}
+    repo = FakeRepo([], refuse={"Backend": (422, exists)})
+
+    names = app.provision_labels(repo, "owner/repo", ["Backend"])
+
+    assert names["backend"] == "Backend"
+    assert backend.get("labels:owner/repo") == ["Backend"]
+
+
+def test_invalid_label_is_left_out_of_cache(backend):
+    invalid = {'message': "Validation Failed", 'errors': [{'resource': "Label", 'code': "invalid", 'field': "name"}]}
+    repo = FakeRepo([], refuse={"Bad,Label": (422, invalid)})
+
+    names = app.provision_labels(repo, "owner/repo", ["Bad,Label", "Backend"])
+
+    assert "bad,label" not in names
+    assert backend.get("labels:owner/repo") == ["Backend"]
+
+
+def test_other_errors_are_raised():
+    repo = FakeRepo([], refuse={"Backend": (500, {'message': "Server Error"})})
+
+    with pytest.raises(GithubException):
+        app.provision_labels(repo, "owner/repo", ["Backend"])
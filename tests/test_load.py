@@ -0,0 +1,104 @@
+"""
+Multi-process load test for the shared state backends.
+
+Each worker process simulates requests that go through the OAuth login and
+callback, bump a metrics counter and take a rate-limit token, then wait on
+an upstream call. With a backend that doesn't serialize the workers,
+throughput grows almost linearly with the number of processes.
+"""
+import multiprocessing
+import socket
+import threading
+import time
+
+import pytest
+
+import app
+
+# Time a simulated request spends waiting on GitHub or the LLM provider
+upstream_latency = 0.02
+duration = 2
+
+
+def make_backend(kind, target):
+    if kind == "sqlite":
+        return app.SQLiteStateBackend(target, app.state_capacities)
+    return app.RedisStateBackend(url=target)
+
+
+def take_token(bucket):
+    bucket = (bucket or 0) + 1
+    return bucket, bucket
+
+
+def worker(kind, target, ready, start, results):
+    backend = make_backend(kind, target)
+    ready.put(True)
+    start.wait()
+    
+    completed = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        state = f"{multiprocessing.current_process().pid}-{completed}"
+        backend.set(f"oauth_state:{state}", True, ttl=600)
+        time.sleep(upstream_latency)
+        assert backend.pop(f"oauth_state:{state}") is True
+        backend.update("ratelimit:global", take_token, ttl=120)
+        backend.incr("metrics:load_requests")
+        completed += 1
+    results.put(completed)
+
+
+def run_workers(kind, target, processes):
+    context = multiprocessing.get_context("spawn")
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    procs = [context.Process(target=worker, args=(kind, target, ready, start, results)) for _ in range(processes)]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.get(timeout=120)
+    start.set()
+    completed = sum(results.get(timeout=60) for _ in procs)
+    for proc in procs:
+        proc.join()
+    return completed
+
+
+def assert_scales(kind, target, backend):
+    single = run_workers(kind, target, 1)
+    parallel = run_workers(kind, target, 4)
+
+    # Near-linear: four workers get through at least 3x the requests of one
+    assert parallel >= 3 * single, (single, parallel)
+    # Every worker saw and updated the same counters
+    assert backend.get("metrics:load_requests") == single + parallel
+    assert backend.get("ratelimit:global") == single + parallel
+
+
+def test_sqlite_backend_scales_across_processes(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    assert_scales("sqlite", path, make_backend("sqlite", path))
+
+
+def test_redis_backend_scales_across_processes():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("redis")
+
+    class FakeRedisServer(fakeredis.TcpFakeServer):
+        # Like a real Redis server, reply without waiting on Nagle's algorithm
+        def get_request(self):
+            conn, addr = super().get_request()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return conn, addr
+    
+    # fakeredis speaking the Redis protocol over TCP stands in for a real server
+    server = FakeRedisServer(("127.0.0.1", 0))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "redis://%s:%d/0" % server.server_address
+        assert_scales("redis", url, make_backend("redis", url))
+    finally:
+        server.shutdown()
+        server.server_close()
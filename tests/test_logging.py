@@ -0,0 +1,70 @@
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+import app
+
+
+def make_record(name, level, msg="message", extra=None):
+    return logging.getLogger(name).makeRecord(name, level, __file__, 1, msg, (), None, extra=extra)
+
+
+def test_json_formatter_emits_standard_and_extra_fields():
+    record = make_record("app", logging.INFO, "Generated project plan", extra={'stage': 'planning', 'tokens': 42})
+    entry = json.loads(app.JsonFormatter().format(record))
+    
+    assert entry['level'] == "INFO"
+    assert entry['logger'] == "app"
+    assert entry['message'] == "Generated project plan"
+    assert entry['stage'] == "planning"
+    assert entry['tokens'] == 42
+    assert "time" in entry
+    # Standard LogRecord attributes are not repeated as fields
+    assert "lineno" not in entry and "exception" not in entry
+
+
+def test_json_formatter_includes_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("app").makeRecord("app", logging.ERROR, __file__, 1, "failed", (), sys.exc_info())
+    entry = json.loads(app.JsonFormatter().format(record))
+    
+    assert "ValueError: boom" in entry['exception']
+
+
+@pytest.fixture
+def sample_rates(monkeypatch):
+    monkeypatch.setitem(app.logging_settings, 'sample_rates', {'DEBUG': 0.0, 'INFO': 1.0})
+
+
+def test_sampling_filter_applies_rates_to_crew_loggers(sample_rates):
+    sampling = app.SamplingFilter()
+    
+    assert not sampling.filter(make_record("crew.trace", logging.DEBUG))
+    assert sampling.filter(make_record("crew.trace", logging.INFO))
+    # Levels without a rate are kept
+    assert sampling.filter(make_record("crew.trace", logging.WARNING))
+
+
+def test_sampling_filter_ignores_other_loggers(sample_rates):
+    sampling = app.SamplingFilter()
+    
+    assert sampling.filter(make_record("app", logging.DEBUG))
+    assert sampling.filter(make_record("werkzeug", logging.DEBUG))
+
+
+def test_deferred_queue_handler_drops_when_full(monkeypatch):
+    monkeypatch.setattr(app.DeferredQueueHandler, "dropped", 0)
+    handler = app.DeferredQueueHandler(queue.Queue(2))
+    
+    for i in range(5):
+        handler.handle(make_record("app", logging.INFO, f"record {i}"))
+    
+    assert handler.queue.qsize() == 2
+    assert app.DeferredQueueHandler.dropped == 3
+    # Records are queued as they are, leaving formatting to the listener
+    assert handler.queue.get_nowait().msg == "record 0"
@@ -0,0 +1,25 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(autouse=True)
+def pinned_crewai(monkeypatch):
+    # The pinned CrewAI has no LLM class, so routes are applied through LangChain
+    monkeypatch.setattr(app, "LLM", None)
+
+
+def test_stage_llm_applies_route_limits(monkeypatch):
+    monkeypatch.setitem(app.stage_routes, "planning", {
+        'model': "gpt-4o", 'max_tokens': 1234, 'timeout': 42, 'fallback_model': "gpt-4o-mini"
+    })
+
+    llm = app.stage_llm("planning")
+
+    assert llm.model_name == "gpt-4o"
+    assert llm.max_tokens == 1234
+    assert llm.request_timeout == 42
+
+
+def test_stage_llm_uses_fallback_model_when_given():
+    assert app.stage_llm("planning", "gpt-4o-mini").model_name == "gpt-4o-mini"
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+plan = "Task 1: Set up the project\nCreate the repo.\n\nTask 2: Add login\nUse OAuth.\n\nTask 3: Deploy\nShip it.\n"
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    monkeypatch.setattr(app, "state_backend", app.MemoryStateBackend(app.state_capacities))
+    monkeypatch.setitem(app.stage_routes, "planning", {
+        'model': "slow-model", 'max_tokens': 100, 'timeout': 1, 'fallback_model': "fast-model"
+    })
+    monkeypatch.setitem(app.stage_routes, "prompts", {
+        'model': "prompt-model", 'max_tokens': 100, 'timeout': 5, 'fallback_model': "prompt-model"
+    })
+
+
+def fake_stream(project_requirements, model, step_callback=None, api_key=None, reference_plan=None):
+    for line in plan.splitlines(keepends=True):
+        if model == "slow-model" and line.startswith("Task 3"):
+            # The primary model stalls once its first task block has started a prompt run
+            time.sleep(1.5)
+        step_callback(line)
+        yield line
+
+
+def test_planning_timeout_falls_back_and_cancels_abandoned_prompt_runs(monkeypatch):
+    cancelled = []
+    
+    def fake_prompts(block, llm, step_callback):
+        try:
+            for _ in range(40):
+                time.sleep(0.05)
+                step_callback("step")
+        except app.PipelineCancelled as e:
+            cancelled.append((block.splitlines()[0], e.reason))
+            raise
+        return f"Prompts for {block.splitlines()[0]}"
+    
+    monkeypatch.setattr(app, "stream_project_plan", fake_stream)
+    monkeypatch.setattr(app, "create_ai_prompts", fake_prompts)
+
+    result = app.generate_pipelined("A todo app")
+
+    assert result['models'] == {'planning': "fast-model", 'prompts': "prompt-model"}
+    assert result['llm_runs'] == 4
+    assert result['ai_prompts'].startswith("## Task 1: Set up the project\n\n")
+    assert "## Task 3: Deploy\n\nPrompts for Task 3: Deploy" in result['ai_prompts']
+    # The slow attempt's prompt run for Task 1 was stopped when the fallback started
+    assert cancelled == [("Task 1: Set up the project", "planning attempt abandoned")]
+    assert app.state_backend.get("metrics:stage_model:planning:fast-model") == 1
+    assert app.state_backend.get("metrics:stage_timeouts:planning:slow-model") == 1
+
+
+def test_failed_prompt_run_cancels_the_others(monkeypatch):
+    cancelled = threading.Event()
+    
+    def fake_prompts(block, llm, step_callback):
+        if "Task 1" in block:
+            raise ValueError("bad output")
+        try:
+            while True:
+                time.sleep(0.05)
+                step_callback("step")
+        except app.PipelineCancelled:
+            cancelled.set()
+            raise
+    
+    monkeypatch.setattr(app, "stream_project_plan", fake_stream)
+    monkeypatch.setattr(app, "create_ai_prompts", fake_prompts)
+    monkeypatch.setitem(app.stage_routes['planning'], 'model', "fast-model")
+
+    with pytest.raises(ValueError):
+        app.generate_pipelined("A todo app")
+    assert cancelled.wait(2)
+
+
+def test_plan_without_headers_is_prompted_as_a_whole(monkeypatch):
+    def headerless_stream(project_requirements, model, step_callback=None, api_key=None, reference_plan=None):
+        yield "Build it in one go.\nThen ship it."
+    
+    monkeypatch.setattr(app, "stream_project_plan", headerless_stream)
+    monkeypatch.setattr(app, "create_ai_prompts", lambda block, llm, step_callback: "All prompts")
+    monkeypatch.setitem(app.stage_routes['planning'], 'model', "fast-model")
+
+    result = app.generate_pipelined("A todo app")
+
+    assert result['ai_prompts'].startswith("## Task 1: Build it in one go.")
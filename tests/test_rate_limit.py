@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = app.MemoryStateBackend({'oauth_state': 1000})
+    monkeypatch.setattr(app, "state_backend", backend)
+    return backend
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "github_client_id", "client-id")
+    monkeypatch.setattr(app, "github_client_secret", "client-secret")
+    return app.app.test_client()
+
+
+def test_buckets_survive_oauth_flood(backend):
+    admission = app.AdmissionController(5, 1000, 100, 100000, max_wait=0, max_queue=0)
+    for _ in range(5):
+        admission.admit("sk-test", 10)
+
+    for i in range(20000):
+        backend.set(f"oauth_state:{i}", True, ttl=600)
+
+    # The drained bucket was not evicted, so the key is still limited
+    with pytest.raises(app.RateLimited):
+        admission.admit("sk-test", 10)
+
+
+def test_github_login_is_rate_limited(backend, client, monkeypatch):
+    monkeypatch.setattr(app.login_admission, "key_limits", {'requests': 3})
+
+    statuses = [client.get("/api/github/login").status_code for _ in range(4)]
+
+    assert statuses == [200, 200, 200, 429]
+    assert sum(1 for key in backend._data if key.startswith("oauth_state:")) == 3
+
+
+def queued_admit(admission, token):
+    """Start an admission that has to queue, and wait until it has joined the queue"""
+    outcome = {}
+    
+    def admit():
+        try:
+            admission.admit("sk-test", 10, token)
+            outcome['admitted'] = True
+        except app.PipelineCancelled as e:
+            outcome['cancelled'] = e.reason
+    
+    thread = threading.Thread(target=admit)
+    thread.start()
+    deadline = time.time() + 5
+    while not app.state_backend.get("ratelimit:queue") and time.time() < deadline:
+        time.sleep(0.01)
+    return thread, outcome
+
+
+def test_generate_prompts_returns_429_with_retry_after(backend, monkeypatch):
+    admission = app.AdmissionController(1, 1000000, 100, 10000000, max_wait=0, max_queue=0)
+    monkeypatch.setattr(app, "admission", admission)
+    monkeypatch.setattr(app, "similar_plans", app.SimilarPlanIndex(0.8))
+    monkeypatch.setattr(app, "run_stage", lambda *args, **kwargs: pytest.fail("run_stage must not run"))
+    admission.admit("sk-test", 10)
+
+    response = app.app.test_client().post("/api/generate-prompts", data={
+        'api_key': "sk-test", 'project_requirements': "A todo app"
+    })
+
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 60
+    assert backend.get("metrics:rate_limited_requests") == 1
+
+
+def test_queue_is_bounded(backend):
+    admission = app.AdmissionController(1, 1000000, 100, 10000000, max_wait=120, max_queue=1)
+    admission.admit("sk-test", 10)
+    token = app.CancellationToken()
+    thread, outcome = queued_admit(admission, token)
+
+    # The one queue slot is taken, so the next request is rejected at once
+    with pytest.raises(app.RateLimited):
+        admission.admit("sk-test", 10)
+    token.cancel("client disconnected")
+    thread.join(5)
+
+    assert outcome == {'cancelled': "client disconnected"}
+    assert backend.get("metrics:queued_requests") == 1
+    assert backend.get("ratelimit:queue") == 0
+
+
+def test_cancelled_queued_request_is_refunded(backend):
+    admission = app.AdmissionController(1, 1000000, 100, 10000000, max_wait=120, max_queue=5)
+    admission.admit("sk-test", 10)
+    token = app.CancellationToken()
+    thread, _ = queued_admit(admission, token)
+    token.cancel("client disconnected")
+    thread.join(5)
+
+    # Only the first request still holds its reservation
+    bucket = backend.get(admission._bucket_key("sk-test"))
+    assert -0.1 < bucket['requests'] < 0.1
+    assert backend.get("ratelimit:global")['requests'] > 99 - 0.1
+
+
+class ProviderRateLimit(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Rate limit reached")
+        self.response = type("Response", (), {'headers': {'retry-after': str(retry_after)}})()
+
+
+def test_run_stage_retries_after_provider_429(backend, monkeypatch):
+    penalties = []
+    monkeypatch.setattr(app.admission, "penalize", lambda api_key, delay: penalties.append((api_key, delay)))
+    attempts = []
+    
+    def run(llm, step_callback):
+        attempts.append(time.time())
+        if len(attempts) == 1:
+            raise ProviderRateLimit(0.3)
+        return "plan"
+    
+    output, model = app.run_stage("planning", run, app.CancellationToken(), "sk-test", make_llm=lambda stage, model: model)
+
+    assert output == "plan"
+    assert model == app.stage_routes['planning']['model']
+    assert penalties == [("sk-test", 0.3)]
+    # The provider's retry-after was honored before the second attempt
+    assert attempts[1] - attempts[0] >= 0.3
+
+
+def test_penalize_blocks_the_key(backend):
+    admission = app.AdmissionController(100, 1000000, 100, 10000000, max_wait=0, max_queue=0)
+    admission.penalize("sk-test", 30)
+
+    with pytest.raises(app.RateLimited) as raised:
+        admission.admit("sk-test", 10)
+    assert 29 < raised.value.retry_after <= 30
+    assert backend.get("metrics:provider_rate_limits") == 1
+
+
+def test_login_limit_uses_forwarded_address_behind_proxy(backend, client, monkeypatch):
+    # What TRUSTED_PROXIES=1 installs at startup
+    monkeypatch.setattr(app.app, "wsgi_app", app.ProxyFix(app.app.wsgi_app, x_for=1))
+    monkeypatch.setattr(app.login_admission, "key_limits", {'requests': 1})
+
+    statuses = [
+        client.get("/api/github/login", headers={'X-Forwarded-For': address}).status_code
+        for address in ("203.0.113.1", "203.0.113.2", "203.0.113.1")
+    ]
+
+    assert statuses == [200, 200, 429]
@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+
+import pytest
+
+import app
+
+rng = random.Random(7)
+vocabulary = [f"word{i}" for i in range(5000)]
+
+
+def requirements(words=150):
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+
+def near_duplicate(text, changes=3):
+    words = text.split()
+    for i in rng.sample(range(len(words)), changes):
+        words[i] = rng.choice(vocabulary)
+    return " ".join(words)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(app, "state_backend", app.MemoryStateBackend(app.state_capacities))
+    return app.SimilarPlanIndex(0.8)
+
+
+@pytest.mark.parametrize("threshold, layout", [(0.8, (16, 4)), (0.6, (32, 2)), (0.95, (8, 8))])
+def test_banding_follows_threshold(threshold, layout):
+    assert app.SimilarPlanIndex.banding(threshold, 64) == layout
+
+
+def test_near_duplicates_are_found(index):
+    originals = [requirements() for _ in range(100)]
+    for i, text in enumerate(originals):
+        index.add(text, {'plan': i})
+
+    # Three changed words out of 150 leave a Jaccard similarity of about 0.88
+    found = [index.lookup(near_duplicate(text), 0.8) for text in originals]
+
+    assert sum(1 for match in found if match) >= 90
+    assert all(match[1] == {'plan': i} for i, match in enumerate(found) if match)
+    assert index.lookup(requirements(), 0.8) is None
+
+
+def test_lookup_stays_under_a_millisecond(index):
+    for i in range(5000):
+        index.add(requirements(), {'plan': i})
+    queries = [requirements() for _ in range(200)]
+
+    durations = []
+    for text in queries:
+        start = time.perf_counter()
+        index.lookup(text, 0.8)
+        durations.append(time.perf_counter() - start)
+
+    assert statistics.median(durations) < 0.001
+
+
+def test_evicted_plans_leave_the_state_backend(index):
+    index.max_entries = 10
+    plan = "x" * 20000
+    for i in range(1000):
+        index.add(requirements(), {'plan': plan, 'i': i})
+
+    stored = [key for key in app.state_backend._data if key.startswith("similar_plan:")]
+    assert len(index._entries) == 10
+    assert len(stored) == 10
+
+
+def test_similar_plan_namespace_is_capped(monkeypatch):
+    backend = app.MemoryStateBackend({'similar_plan': 10})
+    monkeypatch.setattr(app, "state_backend", backend)
+    # Another worker's index has no signatures for these, so only the capacity bounds them
+    for i in range(1000):
+        backend.set(f"similar_plan:{i}", {'plan': "x" * 20000}, ttl=3600)
+
+    assert backend.stats()['entries'] == 10
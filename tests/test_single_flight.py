@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture(autouse=True)
+def backend(monkeypatch):
+    backend = app.MemoryStateBackend(app.state_capacities)
+    monkeypatch.setattr(app, "state_backend", backend)
+    monkeypatch.setattr(app, "similar_plans", app.SimilarPlanIndex(0.8))
+    monkeypatch.setattr(app, "generation_flights", app.SingleFlight(poll_interval=0.01))
+    return backend
+
+
+def run_in_threads(count, target):
+    results = [None] * count
+    
+    def run(i):
+        results[i] = target()
+    
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_identical_calls_in_one_process_run_once():
+    calls = []
+    release = threading.Event()
+    
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return {'plan': "shared"}
+    
+    threading.Timer(0.2, release.set).start()
+    results = run_in_threads(5, lambda: app.generation_flights.do("key", fn))
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result == {'plan': "shared"} for result, _ in results)
+
+
+def test_waits_for_result_published_by_another_worker(backend):
+    backend.set("inflight:key", True, ttl=60)
+    
+    def other_worker_finishes():
+        backend.set("flight_result:key", {'plan': "from another worker"}, ttl=30)
+        backend.delete("inflight:key")
+    
+    threading.Timer(0.1, other_worker_finishes).start()
+    result = app.generation_flights.do("key", lambda: pytest.fail("fn must not run"))
+
+    assert result == ({'plan': "from another worker"}, True)
+
+
+def test_takes_over_when_other_worker_fails_without_result(backend):
+    backend.set("inflight:key", True, ttl=60)
+    threading.Timer(0.1, backend.delete, args=("inflight:key",)).start()
+
+    result = app.generation_flights.do("key", lambda: {'plan': "ours"})
+
+    assert result == ({'plan': "ours"}, False)
+    assert backend.get("inflight:key") is None
+    assert backend.get("flight_result:key") == {'plan': "ours"}
+
+
+def test_waiting_caller_can_be_cancelled(backend):
+    backend.set("inflight:key", True, ttl=60)
+    token = app.CancellationToken(deadline=time.time() + 0.1)
+
+    with pytest.raises(app.PipelineCancelled):
+        app.generation_flights.do("key", lambda: None, token)
+
+
+def fake_run_stage(entered, leader_token):
+    def run_stage(stage, run, cancel_token=None, api_key=None):
+        if cancel_token is leader_token:
+            entered.set()
+            while True:
+                cancel_token.check(stage)
+                time.sleep(0.01)
+        return f"{stage} output", "gpt-test"
+    return run_stage
+
+
+def test_retries_when_joined_run_is_cancelled_by_its_client(backend, monkeypatch):
+    entered = threading.Event()
+    leader_token, follower_token = app.CancellationToken(), app.CancellationToken()
+    monkeypatch.setattr(app, "run_stage", fake_run_stage(entered, leader_token))
+    outcome = {}
+    
+    def leader():
+        try:
+            app.generate_plan_and_prompts("A todo app", leader_token)
+        except app.PipelineCancelled as e:
+            outcome['leader'] = e.reason
+    
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    assert entered.wait(5)
+    threading.Timer(0.2, leader_token.cancel, args=("client disconnected",)).start()
+
+    result = app.generate_plan_and_prompts("A todo app", follower_token)
+    leader_thread.join(5)
+
+    assert outcome['leader'] == "client disconnected"
+    assert result['shared'] is False
+    assert result['project_plan'] == "planning output"
+    assert follower_token.cancelled() is None
+
+
+def test_coalesced_requests_are_counted(backend, monkeypatch):
+    release = threading.Event()
+    
+    def slow_run_stage(stage, run, cancel_token=None, api_key=None):
+        release.wait(5)
+        return f"{stage} output", "gpt-test"
+    
+    monkeypatch.setattr(app, "run_stage", slow_run_stage)
+    threading.Timer(0.2, release.set).start()
+    results = run_in_threads(3, lambda: app.generate_plan_and_prompts("A todo app", app.CancellationToken()))
+
+    assert sorted(result['shared'] for result in results) == [False, True, True]
+    assert backend.get("metrics:generation_runs") == 1
+    assert backend.get("metrics:llm_runs") == 2
+    assert backend.get("metrics:coalesced_requests") == 2
+    assert backend.get("metrics:llm_runs_saved") == 4
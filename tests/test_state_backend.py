@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+import app
+
+
+def flood_logins(backend, count, ttl):
+    for i in range(count):
+        backend.set(f"oauth_state:{i}", True, ttl=ttl)
+
+
+@pytest.fixture
+def backend():
+    return app.MemoryStateBackend({'oauth_state': 1000})
+
+
+def test_oauth_flood_stays_within_capacity(backend):
+    for _ in range(20):
+        flood_logins(backend, 10000, ttl=600)
+        oauth_entries = sum(1 for key in backend._data if key.startswith("oauth_state:"))
+        assert oauth_entries <= 1000
+        assert len(backend._expiry) <= 2 * 1000
+
+    # The newest logins survive, the oldest were evicted
+    assert backend.get("oauth_state:9999") is True
+    assert backend.get("oauth_state:0") is None
+    assert backend.stats()['evictions'] == 20 * 10000 - 1000
+
+
+def test_oauth_flood_does_not_evict_other_state(backend):
+    backend.set("flask_secret_key", "secret")
+    backend.incr("metrics:generation_runs")
+    backend.set("ratelimit:global", {'requests': 5}, ttl=120)
+
+    flood_logins(backend, 50000, ttl=600)
+
+    assert backend.get("flask_secret_key") == "secret"
+    assert backend.get("metrics:generation_runs") == 1
+    assert backend.get("ratelimit:global") == {'requests': 5}
+
+
+def test_oauth_states_expire(backend):
+    flood_logins(backend, 500, ttl=0.05)
+    time.sleep(0.1)
+
+    assert backend.get("oauth_state:1") is None
+    backend.sweep()
+    assert len(backend._data) == 0
+    assert len(backend._expiry) == 0
+
+
+def test_oauth_state_is_single_use(backend):
+    backend.set("oauth_state:abc", True, ttl=600)
+
+    assert backend.pop("oauth_state:abc") is True
+    assert backend.pop("oauth_state:abc") is None
+
+
+def test_sqlite_sweep_evicts_only_capped_namespace(tmp_path):
+    backend = app.SQLiteStateBackend(str(tmp_path / "state.sqlite3"), {'oauth_state': 100})
+    backend.add("flask_secret_key", "secret")
+    backend.set("ratelimit:global", {'requests': 5}, ttl=120)
+
+    flood_logins(backend, 500, ttl=600)
+    backend.sweep()
+
+    assert backend.stats()['entries'] == 102
+    assert backend.get("flask_secret_key") == "secret"
+    assert backend.get("ratelimit:global") == {'requests': 5}
+    assert backend.get("oauth_state:0") is None
+    assert backend.get("oauth_state:499") is True